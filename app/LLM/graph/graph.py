@@ -2,6 +2,9 @@ from langgraph.checkpoint.sqlite import SqliteSaver
 from langgraph.graph import END, StateGraph
 from langgraph.prebuilt import tools_condition
 
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+
 from app.LLM.graph.state import State
 from app.LLM.graph.nodes.assistant import Assistant, assistant_runnable, tools
 from app.LLM.utilities.utilities import create_tool_node_with_fallback
@@ -9,12 +12,22 @@ from app.LLM.utilities.utilities import _print_event
 
 from dotenv import load_dotenv, find_dotenv
 
-from psycopg_pool import ConnectionPool
+from psycopg_pool import ConnectionPool, AsyncConnectionPool
 
 from app.LLM.utilities.checkpoint_memory import PostgresSaver
+from app.LLM.utilities.chatbot_prompts import ChatbotPromptStore
+from app.LLM.utilities.answer_cache import answer_cache
+from app.LLM.utilities.memory import get_history_budget, needs_summary, summarize
+from app.LLM.utilities.tracing import tracer
+from app.vectors_store.utilities.index_versions import index_versions
+from app.vectors_store.utilities.utilities import get_embedding
 
 from langfuse.callback import CallbackHandler
 
+from typing import Any, AsyncIterator, List, Optional
+
+import asyncio
+import traceback
 import uuid
 import os
 
@@ -27,7 +40,8 @@ DB_URI = os.getenv("CHECKPOINT_MEMEORY_DB_URL")
 builder = StateGraph(State)
 
 # Define nodes: these do the work
-builder.add_node("assistant", Assistant(assistant_runnable))
+assistant = Assistant(assistant_runnable)
+builder.add_node("assistant", RunnableLambda(assistant, afunc=assistant.acall, name="assistant"))
 builder.add_node("tools", create_tool_node_with_fallback(tools))
 # Define edges: these determine how the control flow moves
 builder.set_entry_point("assistant")
@@ -46,35 +60,231 @@ pool = ConnectionPool(
     max_size=20,
 )
 
+# The async pool must be opened inside the running event loop,
+# see the lifespan handler in app/backend/main.py.
+async_pool = AsyncConnectionPool(
+    conninfo=DB_URI,
+    max_size=20,
+    open=False,
+)
+
 checkpointer = PostgresSaver(
-    sync_connection=pool
+    sync_connection=pool,
+    async_connection=async_pool,
 )
 checkpointer.create_tables(pool)
 
+# Registered chatbot prompts live in the same database.
+chatbot_prompts = ChatbotPromptStore(
+    sync_connection=pool,
+    async_connection=async_pool,
+)
+chatbot_prompts.create_tables()
+
 graph = builder.compile(checkpointer=checkpointer)
 
 
 # graph.get_graph().draw_mermaid_png(output_file_path="graph.png")
 
 
-def query_llm(query: str, index_name: str, thread_id: str, prompt: str) -> dict:
-    
-    langfuse_handler = CallbackHandler(session_id=thread_id)
-    
-    config = {
-        "callbacks":[langfuse_handler],
+def _run_config(
+    index_name: str,
+    thread_id: str,
+    prompt: str,
+    tenant_id: Optional[str] = None,
+    callbacks: Optional[List[Any]] = None,
+) -> dict:
+    # Tracing callbacks come from `tracer`; unsampled runs have none.
+    return {
+        "callbacks": callbacks or [],
         "configurable": {
             # Checkpoints are accessed by thread_id
             "thread_id": thread_id,
             "index_name": index_name,
             "prompt": prompt,
+            "tenant_id": tenant_id,
         }
     }
-    response = graph.invoke(
-                {"messages": ("user", query)}, config=config, stream_mode="values"
-            )
+
+
+# Strong references to running summary refreshes, so they are not garbage collected mid-run.
+_summary_tasks: set[asyncio.Task] = set()
+
+
+async def _refresh_summary(thread_id: str, tenant_id: Optional[str]) -> None:
+    config = {"configurable": {"thread_id": thread_id, "tenant_id": tenant_id}}
+    try:
+        values = (await graph.aget_state(config)).values
+        messages = values.get("messages", [])
+        summarized = values.get("summary_message_count", 0)
+        due, start = needs_summary(messages, get_history_budget(tenant_id), summarized)
+        if not due:
+            return
+        summary = await summarize(values.get("summary"), messages[summarized:start])
+        # Written as the assistant's output, so the thread stays at a finished run.
+        await graph.aupdate_state(
+            config, {"summary": summary, "summary_message_count": start}, as_node="assistant"
+        )
+    except Exception:
+        # The summary is an optimisation; the next run tries again.
+        traceback.print_exc()
+
+
+def schedule_summary_refresh(thread_id: str, tenant_id: Optional[str]) -> None:
+    """Fold turns that left the history window into the thread's summary, without delaying the response."""
+    task = asyncio.create_task(_refresh_summary(thread_id, tenant_id))
+    _summary_tasks.add(task)
+    task.add_done_callback(_summary_tasks.discard)
+
+
+def query_llm(query: str, index_name: str, thread_id: str, prompt: str) -> dict:
+    
+    with tracer.trace("query_llm", session_id=thread_id, input=query) as run:
+        config = _run_config(index_name=index_name, thread_id=thread_id, prompt=prompt, callbacks=run.callbacks)
+        with checkpointer.buffered(thread_id):
+            response = graph.invoke(
+                        {"messages": ("user", query)}, config=config, stream_mode="values"
+                    )
+        run.output = response["messages"][-1].content
     
     return response
+
+
+async def aquery_llm(
+    query: str,
+    index_name: str,
+    thread_id: str,
+    prompt: str,
+    use_answer_cache: bool = False,
+    tenant_id: Optional[str] = None,
+) -> dict:
+    """
+    Async variant of `query_llm`, used by the API so a slow LLM call does not block the event loop.
+
+    With `use_answer_cache`, the first question of a thread is first looked up in
+    the semantic answer cache (see app/LLM/utilities/answer_cache.py). On a hit
+    the graph is not run, but the question and the cached answer are still
+    written to the thread so the conversation continues normally.
+    """
+    
+    with tracer.trace("query_llm", session_id=thread_id, tenant_id=tenant_id, input=query) as run:
+        response = await _aquery_llm(
+            query=query,
+            index_name=index_name,
+            thread_id=thread_id,
+            prompt=prompt,
+            use_answer_cache=use_answer_cache,
+            tenant_id=tenant_id,
+            callbacks=run.callbacks,
+        )
+        run.output = response["messages"][-1].content
+    return response
+
+
+async def _aquery_llm(
+    query: str,
+    index_name: str,
+    thread_id: str,
+    prompt: str,
+    use_answer_cache: bool,
+    tenant_id: Optional[str],
+    callbacks: List[Any],
+) -> dict:
+    config = _run_config(
+        index_name=index_name, thread_id=thread_id, prompt=prompt, tenant_id=tenant_id, callbacks=callbacks
+    )
+    if not use_answer_cache:
+        async with checkpointer.abuffered(thread_id):
+            response = await graph.ainvoke(
+                        {"messages": ("user", query)}, config=config, stream_mode="values"
+                    )
+        schedule_summary_refresh(thread_id, tenant_id)
+        return response
+
+    snapshot = await graph.aget_state(config)
+    if snapshot.values.get("messages"):
+        # Not a first turn: the answer depends on the conversation so far.
+        async with checkpointer.abuffered(thread_id):
+            response = await graph.ainvoke(
+                        {"messages": ("user", query)}, config=config, stream_mode="values"
+                    )
+        schedule_summary_refresh(thread_id, tenant_id)
+        return response
+
+    index_version = index_versions.get(index_name)
+    embedding = await get_embedding().aembed_query(query)
+    cached = answer_cache.lookup(index_name=index_name, prompt=prompt, embedding=embedding)
+    if cached is not None:
+        # Recorded as the assistant's output, so the next turn resumes from a finished run.
+        await graph.aupdate_state(
+            config,
+            {"messages": [HumanMessage(content=query), AIMessage(content=cached.answer)]},
+            as_node="assistant",
+        )
+        return (await graph.aget_state(config)).values
+
+    async with checkpointer.abuffered(thread_id):
+        response = await graph.ainvoke(
+                    {"messages": ("user", query)}, config=config, stream_mode="values"
+                )
+    answer = response["messages"][-1]
+    if isinstance(answer, AIMessage) and answer.content and not answer.tool_calls:
+        answer_cache.store(
+            index_name=index_name,
+            prompt=prompt,
+            question=query,
+            answer=answer.content,
+            embedding=embedding,
+            index_version=index_version,
+        )
+    return response
+
+
+async def astream_llm(
+    query: str,
+    index_name: str,
+    thread_id: str,
+    prompt: str,
+    include_tool_events: bool = False,
+    tenant_id: Optional[str] = None,
+) -> AsyncIterator[dict]:
+    """
+    Run a chat turn like `aquery_llm` but yield its output as it is produced.
+
+    Yields `{"event": "token", "data": str}` for every token of the assistant
+    node, optionally `tool_start`/`tool_end` events, and finally
+    `{"event": "end", "data": str}` with the complete answer. The run goes
+    through the same checkpointer, so the thread state is persisted as usual
+    (written when the run ends, see `PostgresSaver.abuffered`).
+    """
+    
+    answer = ""
+    with tracer.trace("stream_llm", session_id=thread_id, tenant_id=tenant_id, input=query) as run:
+        config = _run_config(
+            index_name=index_name, thread_id=thread_id, prompt=prompt, tenant_id=tenant_id, callbacks=run.callbacks
+        )
+        async with checkpointer.abuffered(thread_id):
+            async for event in graph.astream_events(
+                {"messages": ("user", query)}, config=config, version="v2"
+            ):
+                kind = event["event"]
+                node = event["metadata"].get("langgraph_node")
+                if kind == "on_chat_model_stream" and node == "assistant":
+                    content = event["data"]["chunk"].content
+                    if content:
+                        yield {"event": "token", "data": content}
+                elif kind == "on_chat_model_end" and node == "assistant":
+                    output = event["data"]["output"]
+                    if not output.tool_calls:
+                        answer = output.content
+                elif include_tool_events and kind == "on_tool_start":
+                    yield {"event": "tool_start", "data": {"name": event["name"], "input": event["data"].get("input")}}
+                elif include_tool_events and kind == "on_tool_end":
+                    yield {"event": "tool_end", "data": {"name": event["name"]}}
+        run.output = answer
+    
+    schedule_summary_refresh(thread_id, tenant_id)
+    yield {"event": "end", "data": answer}
     
 if __name__ == "__main__":
 
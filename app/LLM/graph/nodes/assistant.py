@@ -1,12 +1,12 @@
 from langchain_openai import ChatOpenAI
 from langchain_core.runnables import ensure_config
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.prompt_values import PromptValue
 
-from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
 
 from app.LLM.graph.state import State
-
-from datetime import datetime
+from app.LLM.utilities.chatbot_prompts import build_prompt_template
+from app.LLM.utilities.memory import get_history_budget, trim_history
 
 from app.LLM.graph.tools.retrieve_tool import lookup_info
 
@@ -14,29 +14,56 @@ class Assistant:
     def __init__(self, runnable: Runnable):
         self.runnable = runnable
 
+    @staticmethod
+    def _with_configuration(state: State, config: RunnableConfig) -> dict:
+        configuration = config.get("configurable", {})
+        index_name = configuration.get("index_name", None)
+        prompt = configuration.get("prompt", None)
+        tenant_id = configuration.get("tenant_id", None)
+
+        # print(f"index name: {index_name}")
+
+        messages = trim_history(
+            state["messages"],
+            budget=get_history_budget(tenant_id),
+            summary=state.get("summary"),
+            summary_message_count=state.get("summary_message_count", 0),
+        )
+        return {**state, "messages": messages, "index_name": index_name, "prompt" : prompt}
+
+    @staticmethod
+    def _is_empty(result) -> bool:
+        # If the LLM happens to return an empty response, we will re-prompt it for an actual response.
+        return not result.tool_calls and (
+            not result.content
+            or isinstance(result.content, list)
+            and not result.content[0].get("text")
+        )
+
     def __call__(self, state: State, config: RunnableConfig):
+        state = self._with_configuration(state, config)
         while True:
-            configuration = config.get("configurable", {})
-            index_name = configuration.get("index_name", None)
-            prompt = configuration.get("prompt", None)
-            
-            # print(f"index name: {index_name}")
-            
-            state = {**state, "index_name": index_name, "prompt" : prompt}
-            
             result = self.runnable.invoke(state)
-            
-            # If the LLM happens to return an empty response, we will re-prompt it for an actual response.
-            if not result.tool_calls and (
-                not result.content
-                or isinstance(result.content, list)
-                and not result.content[0].get("text")
-            ):
+
+            if self._is_empty(result):
+                messages = state["messages"] + [("user", "Respond with a real output.")]
+                state = {**state, "messages": messages}
+            else:
+                break
+
+        return {"messages": result}
+
+    async def acall(self, state: State, config: RunnableConfig):
+        state = self._with_configuration(state, config)
+        while True:
+            result = await self.runnable.ainvoke(state)
+
+            if self._is_empty(result):
                 messages = state["messages"] + [("user", "Respond with a real output.")]
                 state = {**state, "messages": messages}
             else:
                 break
-            
+
         return {"messages": result}
 
 
@@ -52,17 +79,18 @@ llm = ChatOpenAI(model="gpt-4o", temperature=0)
 
 # print(prompt)
 
-primary_assistant_prompt = ChatPromptTemplate.from_messages(
-    [
-        (
-            "system",
-            "{prompt} \nCurrent time: {time}.",
-        ),
-        ("placeholder", "{messages}"),
-    ]
-).partial(time=datetime.now())
+def _format_prompt(state: dict) -> PromptValue:
+    # One pre-rendered template per system prompt text, see app/LLM/utilities/chatbot_prompts.py.
+    return build_prompt_template(state["prompt"]).invoke(state)
+
+
+async def _aformat_prompt(state: dict) -> PromptValue:
+    return _format_prompt(state)
+
+
+primary_assistant_prompt = RunnableLambda(_format_prompt, afunc=_aformat_prompt, name="primary_assistant_prompt")
 
 tools = [
     lookup_info,
 ]
-assistant_runnable = primary_assistant_prompt | llm.bind_tools(tools)
\ No newline at end of file
+assistant_runnable = primary_assistant_prompt | llm.bind_tools(tools)
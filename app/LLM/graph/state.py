@@ -6,5 +6,9 @@ from langgraph.graph.message import AnyMessage, add_messages
 
 
 class State(TypedDict):
+    # The full history. What the assistant sends to the model is a window of it, see app/LLM/utilities/memory.py.
     messages: Annotated[list[AnyMessage], add_messages]
+    # Rolling summary of messages[:summary_message_count], refreshed in the background.
+    summary: str
+    summary_message_count: int
     # prompt: str
\ No newline at end of file
@@ -1,26 +1,161 @@
-from langchain_core.tools import tool
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from dotenv import load_dotenv, find_dotenv
+
+from langchain_core.tools import StructuredTool
 from langchain_core.runnables import ensure_config
+from langchain_core.retrievers import BaseRetriever
 
+from app.LLM.utilities.context_packing import pack_documents
+from app.vectors_store.utilities.index_versions import index_versions
 from app.vectors_store.utilities.utilities import get_qdrant_retriever
-@tool
-def lookup_info(query: str) -> str:
-    """
-    Consult the company products and services and return the relevant information.
-    Use this when the customer asks about anything related to the companies products or services (prices, availability, options, etc.).
-    
-    first arg: query that the assistant should search for    
-    """
-    
+
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+
+load_dotenv(find_dotenv())
+
+logger = logging.getLogger(__name__)
+
+RETRIEVER_CACHE_SIZE = int(os.getenv("RETRIEVER_CACHE_SIZE", "128"))
+RETRIEVER_CACHE_TTL_SECONDS = float(os.getenv("RETRIEVER_CACHE_TTL_SECONDS", "300"))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "2048"))
+RETRIEVAL_CACHE_TTL_SECONDS = float(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", "600"))
+
+
+class LRUCache:
+    """Thread-safe LRU mapping with an optional TTL per entry."""
+
+    def __init__(self, max_entries: int, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (self.ttl is not None and entry[1] <= time.monotonic()):
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.set(key, value)
+        return value
+
+
+# Ready-made retrievers and tool outputs, keyed by index version among others.
+# A write to an index bumps its version, so nothing from before it is served.
+# Versions are per process, so both caches also expire: that bounds how long
+# a write made by another server process goes unseen.
+retriever_cache = LRUCache(RETRIEVER_CACHE_SIZE, ttl=RETRIEVER_CACHE_TTL_SECONDS)
+retrieval_cache = LRUCache(RETRIEVAL_CACHE_SIZE, ttl=RETRIEVAL_CACHE_TTL_SECONDS)
+
+
+def _get_index_name() -> str:
     config = ensure_config()  # Fetch from the context
     configuration = config.get("configurable", {})
     index_name = configuration.get("index_name", None)
-    
+
     if not index_name:
         raise ValueError("No index_name configured.")
-    retriever = get_qdrant_retriever(index_name=index_name)
-    
+    return index_name
+
+
+def _retriever_key(index_name: str) -> tuple:
+    return (index_name, index_versions.get(index_name))
+
+
+def _get_retriever(index_name: str) -> BaseRetriever:
+    return retriever_cache.get_or_create(
+        _retriever_key(index_name),
+        lambda: get_qdrant_retriever(index_name=index_name),
+    )
+
+
+def _normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().rstrip("?!.").lower()
+
+
+def _cache_key(index_name: str, query: str) -> tuple:
+    return (index_name, index_versions.get(index_name), _normalize_query(query))
+
+
+def _pack(index_name: str, docs: list) -> str:
+    result, tokens = pack_documents(docs)
+    logger.info("lookup_info on %s: %d chunks packed into %d tokens", index_name, len(docs), tokens)
+    return result
+
+
+def _lookup_info(query: str) -> str:
+    """
+    Consult the company products and services and return the relevant information.
+    Use this when the customer asks about anything related to the companies products or services (prices, availability, options, etc.).
+
+    first arg: query that the assistant should search for
+    """
+    index_name = _get_index_name()
+    key = _cache_key(index_name, query)
+    cached = retrieval_cache.get(key)
+    if cached is not None:
+        return cached
+
     try:
+        retriever = _get_retriever(index_name)
         docs = retriever.invoke(query)
-        return "\n\n".join([doc.page_content for doc in docs])
     except Exception as e:
-        return "Error: index not found"
\ No newline at end of file
+        return "Error: index not found"
+    result = _pack(index_name, docs)
+    retrieval_cache.set(key, result)
+    return result
+
+
+async def _alookup_info(query: str) -> str:
+    index_name = _get_index_name()
+    key = _cache_key(index_name, query)
+    cached = retrieval_cache.get(key)
+    if cached is not None:
+        return cached
+
+    try:
+        retriever = retriever_cache.get(_retriever_key(index_name))
+        if retriever is None:
+            # Building a retriever reads collection metadata and the IDF table with blocking clients.
+            retriever = await asyncio.to_thread(_get_retriever, index_name)
+        docs = await retriever.ainvoke(query)
+    except Exception as e:
+        return "Error: index not found"
+    result = _pack(index_name, docs)
+    retrieval_cache.set(key, result)
+    return result
+
+
+# Sync and async implementations of the same tool: graph.invoke uses the
+# former, graph.ainvoke the latter so retrieval never blocks the event loop.
+lookup_info = StructuredTool.from_function(
+    func=_lookup_info,
+    coroutine=_alookup_info,
+    name="lookup_info",
+)
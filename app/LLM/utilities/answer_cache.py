@@ -0,0 +1,126 @@
+"""Semantic cache of first-turn answers, per (index_name, prompt).
+
+A new conversation whose first question embeds close enough to one already
+answered for the same index and prompt gets the stored answer instead of a
+full assistant -> lookup_info -> assistant run. Only first turns are cached:
+later answers depend on the rest of the thread. Entries expire after
+`ANSWER_CACHE_TTL_SECONDS` and are dropped as soon as the index is written to.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from dotenv import load_dotenv, find_dotenv
+
+from app.vectors_store.utilities.index_versions import index_versions
+
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+
+load_dotenv(find_dotenv())
+
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_PER_INDEX = int(os.getenv("ANSWER_CACHE_MAX_PER_INDEX", "256"))
+ANSWER_CACHE_MAX_INDEXES = int(os.getenv("ANSWER_CACHE_MAX_INDEXES", "1024"))
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    answer: str
+    embedding: np.ndarray
+    index_version: int
+    expires_at: float
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+class SemanticAnswerCache:
+    def __init__(
+        self,
+        threshold: float = ANSWER_CACHE_SIMILARITY_THRESHOLD,
+        ttl: float = ANSWER_CACHE_TTL_SECONDS,
+        max_per_index: int = ANSWER_CACHE_MAX_PER_INDEX,
+        max_indexes: int = ANSWER_CACHE_MAX_INDEXES,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_per_index = max_per_index
+        self.max_indexes = max_indexes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple[str, str], list[CachedAnswer]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding: list[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _live_entries(self, key: tuple[str, str], index_name: str) -> list[CachedAnswer]:
+        """Entries for `key` that are neither expired nor older than the index. Caller holds the lock."""
+        now = time.monotonic()
+        version = index_versions.get(index_name)
+        entries = [
+            entry for entry in self._entries.get(key, [])
+            if entry.expires_at > now and entry.index_version == version
+        ]
+        if entries:
+            self._entries[key] = entries
+            self._entries.move_to_end(key)
+        else:
+            self._entries.pop(key, None)
+        return entries
+
+    def lookup(self, index_name: str, prompt: str, embedding: list[float]) -> Optional[CachedAnswer]:
+        key = (index_name, prompt_hash(prompt))
+        query = self._normalize(embedding)
+        with self._lock:
+            entries = self._live_entries(key, index_name)
+            if entries:
+                similarities = np.stack([entry.embedding for entry in entries]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.hits += 1
+                    return entries[best]
+            self.misses += 1
+            return None
+
+    def store(self, index_name: str, prompt: str, question: str, answer: str, embedding: list[float], index_version: int) -> None:
+        """`index_version` must be read before the answer was generated, so a concurrent re-ingest is not missed."""
+        key = (index_name, prompt_hash(prompt))
+        entry = CachedAnswer(
+            question=question,
+            answer=answer,
+            embedding=self._normalize(embedding),
+            index_version=index_version,
+            expires_at=time.monotonic() + self.ttl,
+        )
+        with self._lock:
+            entries = self._live_entries(key, index_name)
+            entries.append(entry)
+            self._entries[key] = entries[-self.max_per_index:]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_indexes:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "indexes": len(self._entries),
+            }
+
+
+answer_cache = SemanticAnswerCache()
@@ -0,0 +1,147 @@
+"""Chatbot system prompts stored server side.
+
+A business owner registers a prompt once per index and gets back its id, the
+sha256 of its text; chat requests then send the id instead of the prompt.
+Prompts are immutable (a changed prompt is a new id), so both the stored
+texts and their rendered `ChatPromptTemplate`s are cached without expiry.
+
+The rendered template starts with the prompt text as-is, so the system
+prefix sent to the model is byte-identical on every turn and the provider's
+prompt cache can hit. The current time, which changes on every call, goes in
+a separate system message after the conversation.
+"""
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+from functools import lru_cache
+from typing import AsyncGenerator, Generator, Optional, Union
+
+from dotenv import load_dotenv, find_dotenv
+
+from langchain_core.messages import SystemMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
+
+import hashlib
+import os
+import threading
+
+import psycopg
+
+load_dotenv(find_dotenv())
+
+CHATBOT_PROMPT_CACHE_SIZE = int(os.getenv("CHATBOT_PROMPT_CACHE_SIZE", "1024"))
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+
+def _current_time() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M")
+
+
+@lru_cache(maxsize=CHATBOT_PROMPT_CACHE_SIZE)
+def build_prompt_template(prompt: str) -> ChatPromptTemplate:
+    """The assistant's prompt for a system prompt text. The text is not a template: braces are kept literally."""
+    return ChatPromptTemplate.from_messages(
+        [
+            SystemMessage(content=prompt),
+            MessagesPlaceholder("messages", optional=True),
+            ("system", "Current time: {time}."),
+        ]
+    ).partial(time=_current_time)
+
+
+class ChatbotPromptStore:
+    CREATE_TABLES_QUERY = """
+    CREATE TABLE IF NOT EXISTS chatbot_prompts (
+        tenant_id TEXT NOT NULL,
+        index_name TEXT NOT NULL,
+        prompt_id TEXT NOT NULL,
+        prompt TEXT NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (tenant_id, index_name, prompt_id)
+    );
+    """
+
+    INSERT_PROMPT_QUERY = """
+    INSERT INTO chatbot_prompts (tenant_id, index_name, prompt_id, prompt)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (tenant_id, index_name, prompt_id) DO NOTHING;
+    """
+
+    GET_PROMPT_QUERY = """
+    SELECT prompt FROM chatbot_prompts WHERE tenant_id = %s AND index_name = %s AND prompt_id = %s
+    """
+
+    def __init__(
+        self,
+        sync_connection: Union[psycopg.Connection, ConnectionPool],
+        async_connection: Union[psycopg.AsyncConnection, AsyncConnectionPool],
+        cache_size: int = CHATBOT_PROMPT_CACHE_SIZE,
+    ):
+        self.sync_connection = sync_connection
+        self.async_connection = async_connection
+        self.cache_size = cache_size
+        self._cache: OrderedDict[tuple, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _get_sync_connection(self) -> Generator[psycopg.Connection, None, None]:
+        if isinstance(self.sync_connection, ConnectionPool):
+            with self.sync_connection.connection() as conn:
+                yield conn
+        else:
+            yield self.sync_connection
+
+    @asynccontextmanager
+    async def _get_async_connection(self) -> AsyncGenerator[psycopg.AsyncConnection, None]:
+        if isinstance(self.async_connection, AsyncConnectionPool):
+            async with self.async_connection.connection() as conn:
+                yield conn
+        else:
+            yield self.async_connection
+
+    def create_tables(self) -> None:
+        with self._get_sync_connection() as conn:
+            conn.execute(self.CREATE_TABLES_QUERY)
+
+    def _cached(self, key: tuple) -> Optional[str]:
+        with self._lock:
+            prompt = self._cache.get(key)
+            if prompt is not None:
+                self._cache.move_to_end(key)
+            return prompt
+
+    def _remember(self, key: tuple, prompt: str) -> None:
+        with self._lock:
+            self._cache[key] = prompt
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    async def aregister(self, tenant_id: str, index_name: str, prompt: str) -> str:
+        """Store the prompt for the tenant's index and return its id. Registering the same text again is a no-op."""
+        prompt_id = prompt_hash(prompt)
+        key = (tenant_id, index_name, prompt_id)
+        if self._cached(key) is None:
+            async with self._get_async_connection() as conn:
+                await conn.execute(self.INSERT_PROMPT_QUERY, (tenant_id, index_name, prompt_id, prompt))
+            self._remember(key, prompt)
+        return prompt_id
+
+    async def aget(self, tenant_id: str, index_name: str, prompt_id: str) -> Optional[str]:
+        """The prompt text, or None if the tenant registered no such prompt for the index."""
+        key = (tenant_id, index_name, prompt_id)
+        prompt = self._cached(key)
+        if prompt is None:
+            async with self._get_async_connection() as conn:
+                cur = await conn.execute(self.GET_PROMPT_QUERY, key)
+                row = await cur.fetchone()
+            if row is None:
+                return None
+            prompt = row[0]
+            self._remember(key, prompt)
+        return prompt
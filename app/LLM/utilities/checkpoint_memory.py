@@ -1,40 +1,252 @@
-"""Implementation of a langgraph checkpoint saver using Postgres."""
+"""Implementation of a langgraph checkpoint saver using Postgres.
+
+Checkpoints are stored either as full snapshots or, when only messages were
+appended since the previous checkpoint of the thread, as deltas holding just
+the new messages. A delta row points at the row it extends (`base_ts`) and at
+the snapshot its chain starts from (`snapshot_ts`); reading a checkpoint loads
+that snapshot plus the deltas after it in one query and replays them. Every
+`snapshot_every` checkpoints the chain is restarted with a new snapshot.
+
+Old checkpoints are removed by `prune`/`aprune` (see checkpoint_retention.py):
+a thread keeps its latest checkpoints plus the chains they need, and threads
+idle for too long are deleted entirely.
+
+The latest checkpoint of recently active threads is also kept in memory
+(`LatestCheckpointCache`), so a turn does not have to load and replay the
+checkpoint this process wrote at the end of the previous turn.
+
+Inside `buffered(thread_id)`/`abuffered(thread_id)` the checkpoints of the
+thread are written behind: they are queued and written together when the
+block exits, or earlier once `CHECKPOINT_BUFFER_MAX_ROWS` are queued. A chat
+turn then costs one write round trip instead of one per graph step; a crash
+loses at most the checkpoints of the runs in flight. Concurrent runs of a
+thread share its buffer, and each one writes it out when its block exits, so
+no run returns before its last checkpoint is in the table.
+"""
+from collections import OrderedDict
 from contextlib import asynccontextmanager, contextmanager
-from typing import Any, AsyncGenerator, AsyncIterator, Generator, Optional, Union, Tuple, List
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncGenerator, AsyncIterator, Generator, NamedTuple, Optional, Union, Tuple, List
+
+import asyncio
+import json
+import os
+import threading
+import time
 
 import psycopg
 from langchain_core.runnables import RunnableConfig
 from langgraph.checkpoint import BaseCheckpointSaver
 from langgraph.serde.jsonplus import JsonPlusSerializer
-from langgraph.checkpoint.base import Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.base import Checkpoint, CheckpointMetadata, CheckpointTuple, copy_checkpoint
 from psycopg_pool import AsyncConnectionPool, ConnectionPool
 
+from app.LLM.utilities.checkpoint_serde import CheckpointSerializer
 
-class JsonAndBinarySerializer(JsonPlusSerializer):
-    def _default(self, obj):
-        if isinstance(obj, (bytes, bytearray)):
-            return self._encode_constructor_args(
-                obj.__class__, method="fromhex", args=[obj.hex()]
-            )
-        return super()._default(obj)
+CHECKPOINT_SNAPSHOT_EVERY = int(os.getenv("CHECKPOINT_SNAPSHOT_EVERY", "20"))
+# Threads whose last written checkpoint is remembered for delta encoding.
+CHECKPOINT_TRACKED_THREADS = int(os.getenv("CHECKPOINT_TRACKED_THREADS", "10000"))
+# A checkpoint is only stored as a delta of a write this recent. Pruning never
+# deletes rows younger than twice that, nor any row of their chains, so a
+# delta's base rows cannot disappear under it, whichever server process wrote
+# them and however many newer rows other processes wrote since.
+CHECKPOINT_DELTA_MAX_AGE_SECONDS = float(os.getenv("CHECKPOINT_DELTA_MAX_AGE_SECONDS", "3600"))
+
+# Memory budget of the latest-checkpoint cache, approximate. 0 disables the cache.
+CHECKPOINT_CACHE_MAX_BYTES = int(os.getenv("CHECKPOINT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Check that a cached checkpoint is still the latest before using it. Only
+# safe to turn off when a single process writes the checkpoints.
+CHECKPOINT_CACHE_VERIFY = os.getenv("CHECKPOINT_CACHE_VERIFY", "true").lower() == "true"
+
+# Queued checkpoints of a buffered thread that trigger a write before the block exits.
+CHECKPOINT_BUFFER_MAX_ROWS = int(os.getenv("CHECKPOINT_BUFFER_MAX_ROWS", "16"))
+
+# Retention defaults. 0 disables the rule.
+CHECKPOINT_KEEP_LAST = int(os.getenv("CHECKPOINT_KEEP_LAST", "10"))
+CHECKPOINT_IDLE_TTL_DAYS = float(os.getenv("CHECKPOINT_IDLE_TTL_DAYS", "0"))
+# Threads handled per pruning statement (and transaction).
+CHECKPOINT_PRUNE_BATCH_THREADS = int(os.getenv("CHECKPOINT_PRUNE_BATCH_THREADS", "200"))
+# Rows per transaction when filling in the searchable columns of old rows.
+CHECKPOINT_BACKFILL_BATCH_ROWS = int(os.getenv("CHECKPOINT_BACKFILL_BATCH_ROWS", "1000"))
+
+SNAPSHOT = "snapshot"
+DELTA = "delta"
+
+# Schema changes, applied in order. The index of a statement is its version;
+# applied versions are recorded in checkpoint_migrations. Only ever append.
+MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS checkpoints (
+        thread_id TEXT NOT NULL,
+        thread_ts TEXT NOT NULL,
+        parent_ts TEXT,
+        checkpoint BYTEA NOT NULL,
+        metadata BYTEA NOT NULL,
+        PRIMARY KEY (thread_id, thread_ts)
+    );
+    """,
+    # Delta checkpoints. Existing rows are full checkpoints, i.e. snapshots.
+    """
+    ALTER TABLE checkpoints
+        ADD COLUMN IF NOT EXISTS kind TEXT NOT NULL DEFAULT 'snapshot',
+        ADD COLUMN IF NOT EXISTS base_ts TEXT,
+        ADD COLUMN IF NOT EXISTS snapshot_ts TEXT,
+        ADD COLUMN IF NOT EXISTS message_offset INTEGER NOT NULL DEFAULT 0;
+    CREATE INDEX IF NOT EXISTS checkpoints_snapshot_ts_idx
+        ON checkpoints (thread_id, snapshot_ts) WHERE snapshot_ts IS NOT NULL;
+    """,
+    # Format tag of the checkpoint blob, see checkpoint_serde.py. Existing rows are JSON.
+    """
+    ALTER TABLE checkpoints ADD COLUMN IF NOT EXISTS format TEXT NOT NULL DEFAULT 'json';
+    """,
+    # Searchable columns: the tenant and index of the run, the checkpoint time
+    # and the metadata (without "writes", the node outputs) as JSONB. Existing
+    # rows are filled in later by `backfill`, not under the migration lock; the
+    # partial index finds them, and is empty once they are done.
+    """
+    ALTER TABLE checkpoints
+        ADD COLUMN IF NOT EXISTS tenant_id TEXT,
+        ADD COLUMN IF NOT EXISTS index_name TEXT,
+        ADD COLUMN IF NOT EXISTS ts TIMESTAMPTZ,
+        ADD COLUMN IF NOT EXISTS metadata_json JSONB;
+    CREATE INDEX IF NOT EXISTS checkpoints_backfill_idx
+        ON checkpoints (thread_id) WHERE ts IS NULL;
+    CREATE INDEX IF NOT EXISTS checkpoints_tenant_thread_ts_idx
+        ON checkpoints (tenant_id, thread_id, ts DESC);
+    CREATE INDEX IF NOT EXISTS checkpoints_metadata_idx
+        ON checkpoints USING GIN (metadata_json jsonb_path_ops);
+    """,
+    # One row per thread, kept up to date on every write, for listing a
+    # tenant's threads. Seeded from the tenant-tagged rows, read through the
+    # tenant index; threads from before tenant tagging are not listed anyway.
+    """
+    CREATE TABLE IF NOT EXISTS checkpoint_threads (
+        thread_id TEXT PRIMARY KEY,
+        tenant_id TEXT,
+        index_name TEXT,
+        created_at TIMESTAMPTZ NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS checkpoint_threads_tenant_updated_idx
+        ON checkpoint_threads (tenant_id, updated_at DESC, thread_id DESC);
+    INSERT INTO checkpoint_threads (thread_id, tenant_id, index_name, created_at, updated_at)
+        SELECT thread_id, MAX(tenant_id), MAX(index_name), MIN(ts), MAX(ts)
+        FROM checkpoints
+        WHERE tenant_id IS NOT NULL
+        GROUP BY thread_id
+        ON CONFLICT (thread_id) DO NOTHING;
+    """,
+]
+
+CREATE_MIGRATIONS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS checkpoint_migrations (v INTEGER PRIMARY KEY);
+"""
+
+# Serializes migrations across server processes starting at the same time.
+MIGRATIONS_LOCK_ID = 7210351
+
+
+class _LastWrite(NamedTuple):
+    """What this process last wrote for a thread; the next checkpoint may be stored as a delta of it."""
+    thread_ts: str
+    message_ids: tuple
+    snapshot_ts: str
+    chain_length: int
+    written_at: float
+
+
+class _WriteBuffer:
+    """Rows of one thread waiting to be written, in put order."""
+
+    def __init__(self, lock: Union[threading.Lock, asyncio.Lock]):
+        # Writes of a buffer are serialized, so rows reach the table in put order.
+        self.lock = lock
+        # Buffered blocks of the thread currently open.
+        self.users = 1
+        self.rows: List[tuple] = []
+        # (parent_ts, checkpoint, metadata) of the last row, cached once written.
+        self.latest: Optional[tuple] = None
+
+    def take(self) -> Tuple[List[tuple], Optional[tuple]]:
+        rows, latest = self.rows, self.latest
+        self.rows, self.latest = [], None
+        return rows, latest
+
+
+@dataclass
+class PruneStats:
+    threads_scanned: int = 0
+    threads_expired: int = 0
+    threads_pruned: int = 0
+    rows_deleted: int = 0
+    # Stored (possibly TOAST-compressed) size of the deleted blobs. Postgres reuses
+    # the space after (auto)vacuum; the files only shrink with VACUUM FULL.
+    bytes_freed: int = 0
+
+
+def _copy_tuple(checkpoint_tuple: CheckpointTuple) -> CheckpointTuple:
+    """Cached tuples are shared; callers get their own checkpoint dict."""
+    return checkpoint_tuple._replace(checkpoint=copy_checkpoint(checkpoint_tuple.checkpoint))
+
+
+def _checkpoint_size(checkpoint: Checkpoint) -> int:
+    """Rough memory footprint of a checkpoint: its message contents plus a fixed overhead per value."""
+    size = 1024
+    for value in checkpoint["channel_values"].values():
+        for item in value if isinstance(value, list) else [value]:
+            content = getattr(item, "content", item)
+            size += (len(content) if isinstance(content, str) else 256) + 256
+    return size
+
+
+class LatestCheckpointCache:
+    """Thread id -> latest checkpoint tuple, LRU evicted down to `max_bytes`."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._entries: OrderedDict[str, Tuple[CheckpointTuple, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, thread_id: str) -> Optional[CheckpointTuple]:
+        with self._lock:
+            entry = self._entries.get(thread_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(thread_id)
+            self.hits += 1
+            return entry[0]
 
-    def dumps(self, obj: Any) -> tuple[str, bytes]:
-        if isinstance(obj, bytes):
-            return "bytes", obj
-        elif isinstance(obj, bytearray):
-            return "bytearray", obj
+    def set(self, thread_id: str, checkpoint_tuple: CheckpointTuple) -> None:
+        """Keep `checkpoint_tuple` unless a newer checkpoint of the thread is already cached."""
+        size = _checkpoint_size(checkpoint_tuple.checkpoint)
+        thread_ts = checkpoint_tuple.config["configurable"]["thread_ts"]
+        with self._lock:
+            entry = self._entries.get(thread_id)
+            if entry is not None:
+                if entry[0].config["configurable"]["thread_ts"] > thread_ts:
+                    return
+                self._bytes -= entry[1]
+            self._entries[thread_id] = (checkpoint_tuple, size)
+            self._entries.move_to_end(thread_id)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
 
-        return "json", super().dumps(obj)
+    def forget(self, thread_id: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(thread_id, None)
+            if entry is not None:
+                self._bytes -= entry[1]
 
-    def loads(self, s: tuple[str, bytes]) -> Any:
-        if s[0] == "bytes":
-            return s[1]
-        elif s[0] == "bytearray":
-            return bytearray(s[1])
-        elif s[0] == "json":
-            return super().loads(s[1])
-        else:
-            raise NotImplementedError(f"Unknown serialization type: {s[0]}")
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
 
 
 @contextmanager
@@ -94,12 +306,29 @@ class PostgresSaver(BaseCheckpointSaver):
         sync_connection: Optional[Union[psycopg.Connection, ConnectionPool]] = None,
         async_connection: Optional[
             Union[psycopg.AsyncConnection, AsyncConnectionPool]
-        ] = None
-        
+        ] = None,
+        snapshot_every: int = CHECKPOINT_SNAPSHOT_EVERY,
+        serializer: Optional[CheckpointSerializer] = None,
+        cache_max_bytes: int = CHECKPOINT_CACHE_MAX_BYTES,
+        cache_verify: bool = CHECKPOINT_CACHE_VERIFY,
     ):
+        """
+        `snapshot_every=1` stores every checkpoint as a full snapshot.
+        `serializer` encodes checkpoint blobs; metadata is always JSON (`serde`).
+        `cache_max_bytes=0` disables the latest-checkpoint cache.
+        """
         super().__init__(serde=JsonPlusSerializer())
         self.sync_connection = sync_connection
         self.async_connection = async_connection
+        self.serializer = serializer or CheckpointSerializer()
+        self.snapshot_every = snapshot_every
+        self._last_writes: OrderedDict[str, _LastWrite] = OrderedDict()
+        self._last_writes_lock = threading.Lock()
+        self.cache = LatestCheckpointCache(cache_max_bytes) if cache_max_bytes > 0 else None
+        self.cache_verify = cache_verify
+        self._buffers: dict[str, _WriteBuffer] = {}
+        # Guards `_buffers` and the rows of every buffer; never held during a write.
+        self._buffers_lock = threading.Lock()
 
     @contextmanager
     def _get_sync_connection(self) -> Generator[psycopg.Connection, None, None]:
@@ -115,58 +344,278 @@ class PostgresSaver(BaseCheckpointSaver):
         async with _get_async_connection(self.async_connection) as connection:
             yield connection
 
-    CREATE_TABLES_QUERY = """
-    CREATE TABLE IF NOT EXISTS checkpoints (
-        thread_id TEXT NOT NULL,
-        thread_ts TEXT NOT NULL,
-        parent_ts TEXT,
-        checkpoint BYTEA NOT NULL,
-        metadata BYTEA NOT NULL,
-        PRIMARY KEY (thread_id, thread_ts)
-    );
-    """
-
-    
-
     @staticmethod
     def create_tables(connection: Union[psycopg.Connection, ConnectionPool], /) -> None:
-        """Create the schema for the checkpoint saver."""
+        """Create the schema for the checkpoint saver, applying any pending migration."""
         with _get_sync_connection(connection) as conn:
-            with conn.cursor() as cur:
-                cur.execute(PostgresSaver.CREATE_TABLES_QUERY)
-    
+            with conn.transaction():
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATIONS_LOCK_ID,))
+                    cur.execute(CREATE_MIGRATIONS_TABLE_QUERY)
+                    cur.execute("SELECT COALESCE(MAX(v), -1) FROM checkpoint_migrations")
+                    (applied,) = cur.fetchone()
+                    for version in range(applied + 1, len(MIGRATIONS)):
+                        cur.execute(MIGRATIONS[version])
+                        cur.execute("INSERT INTO checkpoint_migrations (v) VALUES (%s)", (version,))
 
     @staticmethod
     async def acreate_tables(
         connection: Union[psycopg.AsyncConnection, AsyncConnectionPool], /
     ) -> None:
-        """Create the schema for the checkpoint saver."""
+        """Create the schema for the checkpoint saver, applying any pending migration."""
         async with _get_async_connection(connection) as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(PostgresSaver.CREATE_TABLES_QUERY)
+            async with conn.transaction():
+                async with conn.cursor() as cur:
+                    await cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATIONS_LOCK_ID,))
+                    await cur.execute(CREATE_MIGRATIONS_TABLE_QUERY)
+                    await cur.execute("SELECT COALESCE(MAX(v), -1) FROM checkpoint_migrations")
+                    (applied,) = await cur.fetchone()
+                    for version in range(applied + 1, len(MIGRATIONS)):
+                        await cur.execute(MIGRATIONS[version])
+                        await cur.execute("INSERT INTO checkpoint_migrations (v) VALUES (%s)", (version,))
 
     @staticmethod
     def drop_tables(connection: psycopg.Connection, /) -> None:
         """Drop the table for the checkpoint saver."""
         with connection.cursor() as cur:
             cur.execute("DROP TABLE IF EXISTS checkpoints;")
+            cur.execute("DROP TABLE IF EXISTS checkpoint_threads;")
+            cur.execute("DROP TABLE IF EXISTS checkpoint_migrations;")
 
     @staticmethod
     async def adrop_tables(connection: psycopg.AsyncConnection, /) -> None:
         """Drop the table for the checkpoint saver."""
         async with connection.cursor() as cur:
             await cur.execute("DROP TABLE IF EXISTS checkpoints;")
+            await cur.execute("DROP TABLE IF EXISTS checkpoint_threads;")
+            await cur.execute("DROP TABLE IF EXISTS checkpoint_migrations;")
 
     UPSERT_CHECKPOINT_QUERY = """
     INSERT INTO checkpoints 
-        (thread_id, thread_ts, parent_ts, checkpoint, metadata)
+        (thread_id, thread_ts, parent_ts, checkpoint, metadata, kind, base_ts, snapshot_ts, message_offset, format,
+         tenant_id, index_name, ts, metadata_json)
     VALUES 
-        (%s, %s, %s, %s, %s)
+        (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s::jsonb)
     ON CONFLICT (thread_id, thread_ts)
     DO UPDATE SET checkpoint = EXCLUDED.checkpoint,
-                  metadata = EXCLUDED.metadata;
+                  metadata = EXCLUDED.metadata,
+                  kind = EXCLUDED.kind,
+                  base_ts = EXCLUDED.base_ts,
+                  snapshot_ts = EXCLUDED.snapshot_ts,
+                  message_offset = EXCLUDED.message_offset,
+                  format = EXCLUDED.format,
+                  tenant_id = EXCLUDED.tenant_id,
+                  index_name = EXCLUDED.index_name,
+                  ts = EXCLUDED.ts,
+                  metadata_json = EXCLUDED.metadata_json;
     """
 
+    # created_at is set by the thread's first write and never changes, so
+    # pruning old checkpoints does not move it. Neither does the owner: the
+    # first tenant to write a thread keeps it.
+    UPSERT_THREAD_QUERY = """
+    INSERT INTO checkpoint_threads (thread_id, tenant_id, index_name, created_at, updated_at)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (thread_id)
+    DO UPDATE SET tenant_id = COALESCE(checkpoint_threads.tenant_id, EXCLUDED.tenant_id),
+                  index_name = COALESCE(EXCLUDED.index_name, checkpoint_threads.index_name),
+                  updated_at = GREATEST(checkpoint_threads.updated_at, EXCLUDED.updated_at);
+    """
+
+    @staticmethod
+    def _thread_row(rows: List[tuple]) -> tuple:
+        """The checkpoint_threads row for a write of `rows`, all of one thread."""
+        timestamps = [row[12] for row in rows]
+        return (rows[0][0], rows[-1][10], rows[-1][11], min(timestamps), max(timestamps))
+
+    @staticmethod
+    def _message_ids(checkpoint: Checkpoint) -> Optional[tuple]:
+        """Identity of each message: its id, and its content in case a message was replaced in place."""
+        messages = checkpoint["channel_values"].get("messages")
+        if not isinstance(messages, list):
+            return None
+        ids = []
+        for message in messages:
+            if getattr(message, "id", None) is None or not isinstance(message.content, str):
+                return None
+            ids.append((message.id, hash(message.content)))
+        return tuple(ids)
+
+    def _encode(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata) -> tuple:
+        """
+        Build the row for `checkpoint`, as a delta of the thread's previous write when possible.
+
+        Must be called synchronously in put order: aput runs as a background
+        task, and the encoding has to see the writes in the order they were made.
+        """
+        thread_id = config["configurable"]["thread_id"]
+        parent_ts = config["configurable"].get("thread_ts")
+        thread_ts = checkpoint["ts"]
+        message_ids = self._message_ids(checkpoint)
+
+        with self._last_writes_lock:
+            last = self._last_writes.get(thread_id)
+            is_delta = (
+                last is not None
+                and message_ids is not None
+                and last.thread_ts != thread_ts
+                and last.chain_length + 1 < self.snapshot_every
+                and time.time() - last.written_at < CHECKPOINT_DELTA_MAX_AGE_SECONDS
+                and message_ids[:len(last.message_ids)] == last.message_ids
+            )
+            if is_delta:
+                offset = len(last.message_ids)
+                messages = checkpoint["channel_values"]["messages"][offset:]
+                stored = {**checkpoint, "channel_values": {**checkpoint["channel_values"], "messages": messages}}
+                row = (DELTA, last.thread_ts, last.snapshot_ts, offset)
+                tracked = _LastWrite(thread_ts, message_ids, last.snapshot_ts, last.chain_length + 1, time.time())
+            else:
+                stored = checkpoint
+                row = (SNAPSHOT, None, None, 0)
+                tracked = (
+                    _LastWrite(thread_ts, message_ids, thread_ts, 0, time.time())
+                    if message_ids is not None
+                    else None
+                )
+
+            if tracked is None:
+                self._last_writes.pop(thread_id, None)
+            else:
+                self._last_writes[thread_id] = tracked
+                self._last_writes.move_to_end(thread_id)
+                while len(self._last_writes) > CHECKPOINT_TRACKED_THREADS:
+                    self._last_writes.popitem(last=False)
+
+        format, blob = self.serializer.dumps(stored)
+        searchable_metadata = {key: value for key, value in metadata.items() if key != "writes"}
+        return (
+            thread_id,
+            thread_ts,
+            parent_ts if parent_ts else None,
+            blob,
+            self.serde.dumps(metadata),
+            *row,
+            format,
+            config["configurable"].get("tenant_id"),
+            config["configurable"].get("index_name"),
+            datetime.fromisoformat(thread_ts),
+            self.serde.dumps(searchable_metadata).decode(),
+        )
+
+    def _forget_thread(self, thread_id: str) -> None:
+        """After a failed write: the next checkpoint must not be a delta of a row that may not exist."""
+        with self._last_writes_lock:
+            self._last_writes.pop(thread_id, None)
+        if self.cache is not None:
+            self.cache.forget(thread_id)
+
+    def _cache_put(self, thread_id: str, parent_ts: Optional[str], checkpoint: Checkpoint, metadata: CheckpointMetadata) -> None:
+        """Cache the checkpoint just written, as `get_tuple` would return it."""
+        if self.cache is None:
+            return
+        self.cache.set(thread_id, CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "thread_ts": checkpoint["ts"]}},
+            checkpoint=copy_checkpoint(checkpoint),
+            metadata=metadata,
+            parent_config={"configurable": {"thread_id": thread_id, "thread_ts": parent_ts}} if parent_ts else None,
+        ))
+
+    def _write(self, thread_id: str, rows: List[tuple]) -> None:
+        try:
+            with self._get_sync_connection() as conn:
+                # One round trip for both statements.
+                with conn.pipeline(), conn.cursor() as cur:
+                    cur.executemany(self.UPSERT_CHECKPOINT_QUERY, rows)
+                    cur.execute(self.UPSERT_THREAD_QUERY, self._thread_row(rows))
+        except Exception:
+            self._forget_thread(thread_id)
+            raise
+
+    async def _awrite(self, thread_id: str, rows: List[tuple]) -> None:
+        try:
+            async with self._get_async_connection() as conn:
+                async with conn.pipeline(), conn.cursor() as cur:
+                    await cur.executemany(self.UPSERT_CHECKPOINT_QUERY, rows)
+                    await cur.execute(self.UPSERT_THREAD_QUERY, self._thread_row(rows))
+        except Exception:
+            self._forget_thread(thread_id)
+            raise
+
+    def _flush(self, thread_id: str, buffer: _WriteBuffer) -> None:
+        with buffer.lock:
+            with self._buffers_lock:
+                rows, latest = buffer.take()
+            if rows:
+                self._write(thread_id, rows)
+                self._cache_put(thread_id, *latest)
+
+    async def _aflush(self, thread_id: str, buffer: _WriteBuffer) -> None:
+        async with buffer.lock:
+            with self._buffers_lock:
+                rows, latest = buffer.take()
+            if rows:
+                await self._awrite(thread_id, rows)
+                self._cache_put(thread_id, *latest)
+
+    def _enter_buffer(self, thread_id: str, is_async: bool) -> Optional[_WriteBuffer]:
+        """Register a buffered block; None if a block of the other kind buffers the thread."""
+        with self._buffers_lock:
+            buffer = self._buffers.get(thread_id)
+            if buffer is None:
+                buffer = self._buffers[thread_id] = _WriteBuffer(asyncio.Lock() if is_async else threading.Lock())
+            elif isinstance(buffer.lock, asyncio.Lock) != is_async:
+                # Its puts are then written directly, see put/aput.
+                return None
+            else:
+                buffer.users += 1
+            return buffer
+
+    def _exit_buffer(self, thread_id: str, buffer: _WriteBuffer) -> None:
+        with self._buffers_lock:
+            buffer.users -= 1
+            if buffer.users == 0:
+                # Unregistered first: a put arriving during the final write goes straight to the table.
+                del self._buffers[thread_id]
+
+    def _buffer_row(
+        self, thread_id: str, is_async: bool, row: tuple, checkpoint: Checkpoint, metadata: CheckpointMetadata
+    ) -> Tuple[Optional[_WriteBuffer], bool]:
+        """Queue the row if a block of the same kind buffers the thread. Returns the buffer and whether it is full."""
+        with self._buffers_lock:
+            buffer = self._buffers.get(thread_id)
+            if buffer is None or isinstance(buffer.lock, asyncio.Lock) != is_async:
+                return None, False
+            buffer.rows.append(row)
+            buffer.latest = (row[2], checkpoint, metadata)
+            return buffer, len(buffer.rows) >= CHECKPOINT_BUFFER_MAX_ROWS
+
+    @contextmanager
+    def buffered(self, thread_id: str) -> Generator[None, None, None]:
+        """Write the thread's checkpoints behind until the block exits. See the module docstring."""
+        buffer = self._enter_buffer(thread_id, is_async=False)
+        if buffer is None:
+            yield
+            return
+        try:
+            yield
+        finally:
+            self._exit_buffer(thread_id, buffer)
+            # Also when another run still buffers the thread: this run's last checkpoint must be written now.
+            self._flush(thread_id, buffer)
+
+    @asynccontextmanager
+    async def abuffered(self, thread_id: str) -> AsyncGenerator[None, None]:
+        """Async variant of `buffered`, for graph.ainvoke/astream runs."""
+        buffer = self._enter_buffer(thread_id, is_async=True)
+        if buffer is None:
+            yield
+            return
+        try:
+            yield
+        finally:
+            self._exit_buffer(thread_id, buffer)
+            await self._aflush(thread_id, buffer)
+
     def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata) -> RunnableConfig:
         """Put the checkpoint for the given configuration.
         Args:
@@ -179,20 +628,14 @@ class PostgresSaver(BaseCheckpointSaver):
             The RunnableConfig that describes the checkpoint that was just created.
             It'll contain the `thread_id` and `thread_ts` of the checkpoint.
         """
-        thread_id = config["configurable"]["thread_id"]
-        parent_ts = config["configurable"].get("thread_ts")
-        with self._get_sync_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    self.UPSERT_CHECKPOINT_QUERY,
-                    (
-                        thread_id,
-                        checkpoint["ts"],
-                        parent_ts if parent_ts else None,
-                        self.serde.dumps(checkpoint),
-                        self.serde.dumps(metadata),
-                    ),
-                )
+        row = self._encode(config, checkpoint, metadata)
+        thread_id = row[0]
+        buffer, full = self._buffer_row(thread_id, False, row, checkpoint, metadata)
+        if buffer is None:
+            self._write(thread_id, [row])
+            self._cache_put(thread_id, row[2], checkpoint, metadata)
+        elif full:
+            self._flush(thread_id, buffer)
 
         return {
             "configurable": {
@@ -215,20 +658,14 @@ class PostgresSaver(BaseCheckpointSaver):
             The RunnableConfig that describes the checkpoint that was just created.
             It'll contain the `thread_id` and `thread_ts` of the checkpoint.
         """
-        thread_id = config["configurable"]["thread_id"]
-        parent_ts = config["configurable"].get("thread_ts")
-        async with self._get_async_connection() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(
-                    self.UPSERT_CHECKPOINT_QUERY,
-                    (
-                        thread_id,
-                        checkpoint["ts"],
-                        parent_ts if parent_ts else None,
-                        self.serde.dumps(checkpoint),
-                        self.serde.dumps(metadata),
-                    ),
-                )
+        row = self._encode(config, checkpoint, metadata)
+        thread_id = row[0]
+        buffer, full = self._buffer_row(thread_id, True, row, checkpoint, metadata)
+        if buffer is None:
+            await self._awrite(thread_id, [row])
+            self._cache_put(thread_id, row[2], checkpoint, metadata)
+        elif full:
+            await self._aflush(thread_id, buffer)
 
         return {
             "configurable": {
@@ -237,13 +674,133 @@ class PostgresSaver(BaseCheckpointSaver):
             },
         }
 
-    LIST_CHECKPOINTS_QUERY_STR = """
-    SELECT checkpoint, metadata, thread_ts, parent_ts
+    COLUMNS = "thread_id, checkpoint, metadata, thread_ts, parent_ts, kind, base_ts, snapshot_ts, message_offset, format"
+
+    # Ordered by thread_ts, not ts: ts stays NULL on old rows until the backfill
+    # reaches them. UTC ISO timestamps sort the same as text.
+    LIST_CHECKPOINTS_QUERY_STR = f"""
+    SELECT {COLUMNS}
     FROM checkpoints
-    {where}
-    ORDER BY thread_ts DESC
+    {{where}}
+    ORDER BY thread_ts DESC, thread_id DESC
     """
 
+    # The target row (latest, or the given thread_ts), the snapshot its chain
+    # starts from and every delta of that chain up to the target.
+    GET_CHECKPOINT_CHAIN_QUERY_STR = f"""
+    WITH target AS (
+        SELECT thread_ts, COALESCE(snapshot_ts, thread_ts) AS root
+        FROM checkpoints
+        WHERE thread_id = %(thread_id)s {{target_where}}
+        ORDER BY thread_ts DESC LIMIT 1
+    )
+    SELECT {", ".join("c." + column.strip() for column in COLUMNS.split(","))}
+    FROM checkpoints c, target t
+    WHERE c.thread_id = %(thread_id)s
+      AND (c.thread_ts = t.root OR (c.snapshot_ts = t.root AND c.thread_ts <= t.thread_ts))
+    ORDER BY c.thread_ts
+    """
+
+    # Every chain a page of `list` results needs: for each (thread, snapshot
+    # root), the snapshot and its deltas up to the newest listed row.
+    GET_CHAINS_QUERY_STR = f"""
+    SELECT {", ".join("c." + column.strip() for column in COLUMNS.split(","))}
+    FROM checkpoints c
+    JOIN unnest(%(thread_ids)s::text[], %(roots)s::text[], %(upto)s::text[]) AS r(thread_id, root, upto)
+      ON c.thread_id = r.thread_id
+     AND (c.thread_ts = r.root OR (c.snapshot_ts = r.root AND c.thread_ts <= r.upto))
+    """
+
+    def _chain_query(self, thread_ts: Optional[str]) -> str:
+        target_where = "AND thread_ts = %(thread_ts)s" if thread_ts else ""
+        return self.GET_CHECKPOINT_CHAIN_QUERY_STR.format(target_where=target_where)
+
+    def _replay(self, rows: List[tuple]) -> Optional[CheckpointTuple]:
+        """Rebuild the last row of a chain (snapshot first, deltas in thread_ts order)."""
+        if not rows:
+            return None
+        return self._rebuild(rows[-1], {(row[0], row[3]): row for row in rows})
+
+    def _rebuild(self, row: tuple, rows: dict[tuple, tuple], memo: Optional[dict[tuple, list]] = None) -> CheckpointTuple:
+        """
+        Rebuild `row` from the rows of its chain, keyed by (thread_id, thread_ts).
+
+        `memo` keeps the reconstructed messages of every row replayed, so the
+        rows of one page share the work of replaying a common chain.
+        """
+        memo = {} if memo is None else memo
+        ancestors = []
+        messages = None
+        current = row
+        while current[5] == DELTA:
+            key = (current[0], current[6])
+            if key in memo:
+                messages = memo[key]
+                break
+            base = rows.get(key)
+            if base is None:
+                raise ValueError(f"Checkpoint {current[3]} of thread {current[0]} extends missing checkpoint {current[6]}")
+            ancestors.append(base)
+            current = base
+
+        for ancestor in reversed(ancestors):
+            messages = self._messages(ancestor, messages)
+            memo[(ancestor[0], ancestor[3])] = messages
+        return self._to_tuple(row, messages)
+
+    @staticmethod
+    def _chains_params(rows: List[tuple]) -> Optional[dict]:
+        """Parameters of GET_CHAINS_QUERY_STR for the delta rows of a page; None if there are none."""
+        upto: dict[tuple, str] = {}
+        for row in rows:
+            if row[5] == DELTA:
+                key = (row[0], row[7])
+                upto[key] = max(upto.get(key, row[3]), row[3])
+        if not upto:
+            return None
+        return {
+            "thread_ids": [thread_id for thread_id, _ in upto],
+            "roots": [root for _, root in upto],
+            "upto": list(upto.values()),
+        }
+
+    def _page_tuples(self, rows: List[tuple], chain_rows: List[tuple]) -> List[CheckpointTuple]:
+        by_key = {(row[0], row[3]): row for row in chain_rows}
+        memo: dict[tuple, list] = {}
+        return [self._rebuild(row, by_key, memo) for row in rows]
+
+    def _messages(self, row: tuple, base_messages: Optional[list]) -> Optional[list]:
+        messages = self.serializer.loads(row[9], row[1])["channel_values"].get("messages")
+        if row[5] == DELTA:
+            return base_messages[:row[8]] + messages
+        return messages
+
+    def _to_tuple(self, row: tuple, base_messages: Optional[list] = None) -> CheckpointTuple:
+        """`base_messages` are the reconstructed messages of the row a delta extends."""
+        thread_id, checkpoint, metadata, thread_ts, parent_ts, kind = row[:6]
+        checkpoint = self.serializer.loads(row[9], checkpoint)
+        if kind == DELTA:
+            channel_values = checkpoint["channel_values"]
+            channel_values["messages"] = base_messages[:row[8]] + channel_values["messages"]
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "thread_ts": thread_ts,
+                }
+            },
+            checkpoint=checkpoint,
+            metadata=self.serde.loads(metadata),
+            parent_config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "thread_ts": parent_ts,
+                }
+            }
+            if parent_ts
+            else None,
+        )
+
     def list(
         self,
         config: Optional[RunnableConfig],
@@ -256,31 +813,18 @@ class PostgresSaver(BaseCheckpointSaver):
         where, args = self._search_where(config, filter, before)
         query = self.LIST_CHECKPOINTS_QUERY_STR.format(where=where)
         if limit:
-            query += f" LIMIT {limit}"
+            query += f" LIMIT {int(limit)}"
         with self._get_sync_connection() as conn:
             with conn.cursor() as cur:
-                thread_id = config["configurable"]["thread_id"]
                 cur.execute(query, tuple(args))
-                for value in cur:
-                    checkpoint, metadata, thread_ts, parent_ts = value
-                    yield CheckpointTuple(
-                        config={
-                            "configurable": {
-                                "thread_id": thread_id,
-                                "thread_ts": thread_ts,
-                            }
-                        },
-                        checkpoint=self.serde.loads(checkpoint),
-                        metadata=self.serde.loads(metadata),
-                        parent_config={
-                            "configurable": {
-                                "thread_id": thread_id,
-                                "thread_ts": thread_ts,
-                            }
-                        }
-                        if parent_ts
-                        else None,
-                    )
+                rows = cur.fetchall()
+                chain_rows = []
+                # The chains of all delta rows in one query, not one per row.
+                chains_params = self._chains_params(rows)
+                if chains_params is not None:
+                    cur.execute(self.GET_CHAINS_QUERY_STR, chains_params)
+                    chain_rows = cur.fetchall()
+        yield from self._page_tuples(rows, chain_rows)
 
     async def alist(
         self,
@@ -294,45 +838,45 @@ class PostgresSaver(BaseCheckpointSaver):
         where, args = self._search_where(config, filter, before)
         query = self.LIST_CHECKPOINTS_QUERY_STR.format(where=where)
         if limit:
-            query += f" LIMIT {limit}"
+            query += f" LIMIT {int(limit)}"
         async with self._get_async_connection() as conn:
             async with conn.cursor() as cur:
-                thread_id = config["configurable"]["thread_id"]
                 await cur.execute(query, tuple(args))
-                async for value in cur:
-                    checkpoint, metadata, thread_ts, parent_ts = value
-                    yield CheckpointTuple(
-                        config={
-                            "configurable": {
-                                "thread_id": thread_id,
-                                "thread_ts": thread_ts,
-                            }
-                        },
-                        checkpoint=self.serde.loads(checkpoint),
-                        metadata=self.serde.loads(metadata),
-                        parent_config={
-                            "configurable": {
-                                "thread_id": thread_id,
-                                "thread_ts": thread_ts,
-                            }
-                        }
-                        if parent_ts
-                        else None,
-                    )
-
-    GET_CHECKPOINT_BY_TS_QUERY = """
-    SELECT checkpoint, metadata, thread_ts, parent_ts
-    FROM checkpoints
-    WHERE thread_id = %(thread_id)s AND thread_ts = %(thread_ts)s
-    """
+                rows = await cur.fetchall()
+                chain_rows = []
+                chains_params = self._chains_params(rows)
+                if chains_params is not None:
+                    await cur.execute(self.GET_CHAINS_QUERY_STR, chains_params)
+                    chain_rows = await cur.fetchall()
+        for checkpoint_tuple in self._page_tuples(rows, chain_rows):
+            yield checkpoint_tuple
 
-    GET_CHECKPOINT_QUERY = """
-    SELECT checkpoint, metadata, thread_ts, parent_ts
-    FROM checkpoints
-    WHERE thread_id = %(thread_id)s
-    ORDER BY thread_ts DESC LIMIT 1
+    # The version check for a cached checkpoint: an index-only lookup, no blob is read.
+    LATEST_THREAD_TS_QUERY = """
+    SELECT MAX(thread_ts) FROM checkpoints WHERE thread_id = %s
     """
 
+    def _cached(self, thread_id: str, thread_ts: Optional[str]) -> Optional[CheckpointTuple]:
+        """The cached latest checkpoint of the thread, if it is the one asked for."""
+        if self.cache is None:
+            return None
+        cached = self.cache.get(thread_id)
+        if cached is None or (thread_ts and cached.config["configurable"]["thread_ts"] != thread_ts):
+            return None
+        return cached
+
+    def _cache_latest(
+        self, thread_id: str, thread_ts: Optional[str], checkpoint_tuple: Optional[CheckpointTuple]
+    ) -> Optional[CheckpointTuple]:
+        if self.cache is None or thread_ts:
+            return checkpoint_tuple
+        if checkpoint_tuple is None:
+            # Deleted, e.g. expired by another process.
+            self.cache.forget(thread_id)
+            return None
+        self.cache.set(thread_id, checkpoint_tuple)
+        return _copy_tuple(checkpoint_tuple)
+
     def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
         """Get the checkpoint tuple for the given configuration.
         Args:
@@ -347,61 +891,17 @@ class PostgresSaver(BaseCheckpointSaver):
         """
         thread_id = config["configurable"]["thread_id"]
         thread_ts = config["configurable"].get("thread_ts")
+        cached = self._cached(thread_id, thread_ts)
+        if cached is not None and (thread_ts or not self.cache_verify):
+            return _copy_tuple(cached)
         with self._get_sync_connection() as conn:
             with conn.cursor() as cur:
-                if thread_ts:
-                    cur.execute(
-                        self.GET_CHECKPOINT_BY_TS_QUERY,
-                        {
-                            "thread_id": thread_id,
-                            "thread_ts": thread_ts,
-                        },
-                    )
-                    value = cur.fetchone()
-                    if value:
-                        checkpoint, metadata, thread_ts, parent_ts = value
-                    return CheckpointTuple(
-                            config=config,
-                            checkpoint=self.serde.loads(checkpoint),
-                            metadata=self.serde.loads(metadata),
-                            parent_config={
-                                "configurable": {
-                                    "thread_id": thread_id,
-                                    "thread_ts": thread_ts,
-                                }
-                            }
-                            if thread_ts
-                            else None,
-                        )
-                else:
-                    cur.execute(
-                        self.GET_CHECKPOINT_QUERY,
-                        {
-                            "thread_id": thread_id,
-                        },
-                    )
-                    value = cur.fetchone()
-                    if value:
-                        checkpoint, metadata, thread_ts, parent_ts = value
-                        return CheckpointTuple(
-                            config={
-                                "configurable": {
-                                    "thread_id": thread_id,
-                                    "thread_ts": thread_ts,
-                                }
-                            },
-                            checkpoint=self.serde.loads(checkpoint),
-                            metadata=self.serde.loads(metadata),
-                            parent_config={
-                                "configurable": {
-                                    "thread_id": thread_id,
-                                    "thread_ts": parent_ts,
-                                }
-                            }
-                            if parent_ts
-                            else None,
-                        )
-        return None
+                if cached is not None:
+                    cur.execute(self.LATEST_THREAD_TS_QUERY, (thread_id,))
+                    if cur.fetchone()[0] == cached.config["configurable"]["thread_ts"]:
+                        return _copy_tuple(cached)
+                cur.execute(self._chain_query(thread_ts), {"thread_id": thread_id, "thread_ts": thread_ts})
+                return self._cache_latest(thread_id, thread_ts, self._replay(cur.fetchall()))
 
     async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
         """Get the checkpoint tuple for the given configuration.
@@ -417,62 +917,275 @@ class PostgresSaver(BaseCheckpointSaver):
         """
         thread_id = config["configurable"]["thread_id"]
         thread_ts = config["configurable"].get("thread_ts")
+        cached = self._cached(thread_id, thread_ts)
+        if cached is not None and (thread_ts or not self.cache_verify):
+            return _copy_tuple(cached)
+        async with self._get_async_connection() as conn:
+            async with conn.cursor() as cur:
+                if cached is not None:
+                    await cur.execute(self.LATEST_THREAD_TS_QUERY, (thread_id,))
+                    if (await cur.fetchone())[0] == cached.config["configurable"]["thread_ts"]:
+                        return _copy_tuple(cached)
+                await cur.execute(self._chain_query(thread_ts), {"thread_id": thread_id, "thread_ts": thread_ts})
+                return self._cache_latest(thread_id, thread_ts, self._replay(await cur.fetchall()))
+
+    # Threads of a tenant, most recently active first: one range scan of the
+    # (tenant_id, updated_at DESC, thread_id DESC) index per page.
+    LIST_THREADS_QUERY_STR = """
+    SELECT thread_id, index_name, created_at, updated_at
+    FROM checkpoint_threads
+    WHERE tenant_id = %(tenant_id)s {before}
+    ORDER BY updated_at DESC, thread_id DESC
+    LIMIT %(limit)s
+    """
+
+    THREAD_BELONGS_TO_QUERY = """
+    SELECT 1 FROM checkpoint_threads WHERE thread_id = %s AND tenant_id = %s
+    """
+
+    THREAD_BELONGS_TO_OTHER_QUERY = """
+    SELECT 1 FROM checkpoint_threads WHERE thread_id = %s AND tenant_id <> %s
+    """
+
+    async def alist_threads(
+        self, tenant_id: str, before: Optional[Tuple[datetime, str]] = None, limit: int = 50
+    ) -> List[tuple]:
+        """
+        (thread_id, index_name, created_at, updated_at) of the tenant's threads.
+
+        `before` is the (updated_at, thread_id) of the last thread of the previous page.
+        Checkpoints older than this process's tenant tagging are not listed.
+        """
+        params = {"tenant_id": tenant_id, "limit": limit}
+        where = ""
+        if before is not None:
+            where = "AND (updated_at, thread_id) < (%(before_ts)s, %(before_thread_id)s)"
+            params["before_ts"], params["before_thread_id"] = before
         async with self._get_async_connection() as conn:
             async with conn.cursor() as cur:
-                if thread_ts:
-                    await cur.execute(
-                        self.GET_CHECKPOINT_BY_TS_QUERY,
-                        {
-                            "thread_id": thread_id,
-                            "thread_ts": thread_ts,
-                        },
-                    )
-                    value = await cur.fetchone()
-                    if value:
-                        checkpoint, metadata, thread_ts, parent_ts = value
-                    return CheckpointTuple(
-                            config=config,
-                            checkpoint=self.serde.loads(checkpoint),
-                            metadata=self.serde.loads(metadata),
-                            parent_config={
-                                "configurable": {
-                                    "thread_id": thread_id,
-                                    "thread_ts": thread_ts,
-                                }
-                            }
-                            if thread_ts
-                            else None,
-                        )
-                else:
-                    await cur.execute(
-                        self.GET_CHECKPOINT_QUERY,
-                        {
-                            "thread_id": thread_id,
-                        },
-                    )
-                    value = await cur.fetchone()
-                    if value:
-                        checkpoint, metadata, thread_ts, parent_ts = value
-                        return CheckpointTuple(
-                            config={
-                                "configurable": {
-                                    "thread_id": thread_id,
-                                    "thread_ts": thread_ts,
-                                }
-                            },
-                            checkpoint=self.serde.loads(checkpoint),
-                            metadata=self.serde.loads(metadata),
-                            parent_config={
-                                "configurable": {
-                                    "thread_id": thread_id,
-                                    "thread_ts": parent_ts,
-                                }
-                            }
-                            if parent_ts
-                            else None,
-                        )
-
-        return None
+                await cur.execute(self.LIST_THREADS_QUERY_STR.format(before=where), params)
+                return await cur.fetchall()
+
+    async def athread_belongs_to(self, thread_id: str, tenant_id: str) -> bool:
+        async with self._get_async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(self.THREAD_BELONGS_TO_QUERY, (thread_id, tenant_id))
+                return await cur.fetchone() is not None
+
+    async def athread_belongs_to_other(self, thread_id: str, tenant_id: str) -> bool:
+        """Whether another tenant owns the thread; a new thread belongs to no one yet."""
+        async with self._get_async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(self.THREAD_BELONGS_TO_OTHER_QUERY, (thread_id, tenant_id))
+                return await cur.fetchone() is not None
+
+    # One batch of rows from before the searchable columns. SKIP LOCKED lets
+    # several server processes backfill at the same time.
+    BACKFILL_QUERY = """
+    WITH batch AS (
+        SELECT thread_id, thread_ts FROM checkpoints
+        WHERE ts IS NULL
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE checkpoints c
+    SET ts = c.thread_ts::timestamptz,
+        metadata_json = convert_from(c.metadata, 'UTF8')::jsonb - 'writes'
+    FROM batch b
+    WHERE c.thread_id = b.thread_id AND c.thread_ts = b.thread_ts
+    """
+
+    def backfill(self, batch_rows: int = CHECKPOINT_BACKFILL_BATCH_ROWS) -> int:
+        """Fill in `ts` and `metadata_json` of rows written before they existed, one batch per transaction."""
+        updated = 0
+        while True:
+            with self._get_sync_connection() as conn:
+                with conn.transaction():
+                    with conn.cursor() as cur:
+                        cur.execute(self.BACKFILL_QUERY, (batch_rows,))
+                        rows = cur.rowcount
+            updated += rows
+            if rows < batch_rows:
+                return updated
+
+    async def abackfill(self, batch_rows: int = CHECKPOINT_BACKFILL_BATCH_ROWS) -> int:
+        """Async variant of `backfill`. Started from the API server's lifespan."""
+        updated = 0
+        while True:
+            async with self._get_async_connection() as conn:
+                async with conn.transaction():
+                    async with conn.cursor() as cur:
+                        await cur.execute(self.BACKFILL_QUERY, (batch_rows,))
+                        rows = cur.rowcount
+            updated += rows
+            if rows < batch_rows:
+                return updated
+
+    PRUNE_THREADS_PAGE_QUERY = """
+    SELECT thread_id, MAX(thread_ts), COUNT(*)
+    FROM checkpoints
+    WHERE thread_id > %s
+    GROUP BY thread_id
+    ORDER BY thread_id
+    LIMIT %s
+    """
+
+    # Rows to delete in one batch of threads: every row of the expired threads,
+    # and in the other threads the rows past the latest `keep_last`, unless a
+    # kept row belongs to the same chain (same snapshot root). Rows younger
+    # than `grace_cutoff` are kept, and so are their chains: another process
+    # may still be appending deltas to a chain that newer rows outrank.
+    PRUNE_QUERY_STR = """
+    WITH ranked AS (
+        SELECT thread_id, thread_ts, COALESCE(snapshot_ts, thread_ts) AS root,
+               row_number() OVER (PARTITION BY thread_id ORDER BY thread_ts DESC) AS rank
+        FROM checkpoints
+        WHERE thread_id = ANY(%(pruned)s)
+    ),
+    kept_roots AS (
+        SELECT DISTINCT thread_id, root FROM ranked
+        WHERE rank <= %(keep_last)s OR thread_ts >= %(grace_cutoff)s
+    ),
+    doomed AS (
+        SELECT r.thread_id, r.thread_ts
+        FROM ranked r
+        WHERE r.rank > %(keep_last)s
+          AND NOT EXISTS (SELECT 1 FROM kept_roots k WHERE k.thread_id = r.thread_id AND k.root = r.root)
+        UNION ALL
+        SELECT e.thread_id, e.thread_ts
+        FROM checkpoints e
+        WHERE e.thread_id = ANY(%(expired)s)
+          AND NOT EXISTS (
+              SELECT 1 FROM checkpoints n WHERE n.thread_id = e.thread_id AND n.thread_ts >= %(idle_cutoff)s
+          )
+    ){action}
+    """
+
+    PRUNE_DELETE_ACTION = """,
+    deleted_threads AS (
+        DELETE FROM checkpoint_threads t
+        WHERE t.thread_id = ANY(%(expired)s)
+          AND NOT EXISTS (
+              SELECT 1 FROM checkpoints n WHERE n.thread_id = t.thread_id AND n.thread_ts >= %(idle_cutoff)s
+          )
+    ),
+    deleted AS (
+        DELETE FROM checkpoints c
+        USING doomed d
+        WHERE c.thread_id = d.thread_id AND c.thread_ts = d.thread_ts
+        RETURNING pg_column_size(c.checkpoint) + pg_column_size(c.metadata) AS size
+    )
+    SELECT COUNT(*), COALESCE(SUM(size), 0) FROM deleted"""
+
+    PRUNE_DRY_RUN_ACTION = """
+    SELECT COUNT(*), COALESCE(SUM(pg_column_size(c.checkpoint) + pg_column_size(c.metadata)), 0)
+    FROM checkpoints c JOIN doomed d ON c.thread_id = d.thread_id AND c.thread_ts = d.thread_ts"""
+
+    def _prune_query(self, dry_run: bool) -> str:
+        return self.PRUNE_QUERY_STR.format(action=self.PRUNE_DRY_RUN_ACTION if dry_run else self.PRUNE_DELETE_ACTION)
+
+    @staticmethod
+    def _prune_cutoffs(idle_ttl_days: float) -> Tuple[str, str]:
+        """The grace and idle cutoffs, as thread_ts values (UTC ISO timestamps compare as text)."""
+        now = datetime.now(timezone.utc)
+        grace = timedelta(seconds=2 * CHECKPOINT_DELTA_MAX_AGE_SECONDS)
+        idle = max(timedelta(days=idle_ttl_days), grace) if idle_ttl_days else None
+        return (now - grace).isoformat(), (now - idle).isoformat() if idle else ""
+
+    @staticmethod
+    def _prune_params(
+        page: List[tuple], keep_last: int, grace_cutoff: str, idle_cutoff: str, stats: PruneStats
+    ) -> Optional[dict]:
+        """Sort a page of (thread_id, latest thread_ts, row count) into expired and over-limit threads."""
+        expired = [thread_id for thread_id, latest, _ in page if latest < idle_cutoff]
+        pruned = [
+            thread_id for thread_id, latest, count in page
+            if keep_last and count > keep_last and not latest < idle_cutoff
+        ]
+        stats.threads_scanned += len(page)
+        stats.threads_expired += len(expired)
+        stats.threads_pruned += len(pruned)
+        if not expired and not pruned:
+            return None
+        return {
+            "expired": expired,
+            "pruned": pruned,
+            "keep_last": keep_last,
+            "grace_cutoff": grace_cutoff,
+            "idle_cutoff": idle_cutoff,
+        }
+
+    def prune(
+        self,
+        keep_last: int = CHECKPOINT_KEEP_LAST,
+        idle_ttl_days: float = CHECKPOINT_IDLE_TTL_DAYS,
+        batch_threads: int = CHECKPOINT_PRUNE_BATCH_THREADS,
+        dry_run: bool = False,
+    ) -> PruneStats:
+        """
+        Delete old checkpoints, `batch_threads` threads per transaction.
+
+        Keeps the latest `keep_last` checkpoints of each thread (and the chains
+        their deltas replay from), and deletes threads whose latest checkpoint
+        is older than `idle_ttl_days`. 0 disables either rule. With `dry_run`,
+        only counts what would be deleted.
+        """
+        stats = PruneStats()
+        grace_cutoff, idle_cutoff = self._prune_cutoffs(idle_ttl_days)
+        query = self._prune_query(dry_run)
+        last_thread_id = ""
+        while True:
+            with self._get_sync_connection() as conn:
+                with conn.transaction():
+                    with conn.cursor() as cur:
+                        cur.execute(self.PRUNE_THREADS_PAGE_QUERY, (last_thread_id, batch_threads))
+                        page = cur.fetchall()
+                        params = self._prune_params(page, keep_last, grace_cutoff, idle_cutoff, stats)
+                        if params is not None:
+                            cur.execute(query, params)
+                            rows, size = cur.fetchone()
+                            stats.rows_deleted += rows
+                            stats.bytes_freed += size
+            if not page:
+                return stats
+            if params is not None and not dry_run:
+                for thread_id in params["expired"]:
+                    self._forget_thread(thread_id)
+            last_thread_id = page[-1][0]
+
+    async def aprune(
+        self,
+        keep_last: int = CHECKPOINT_KEEP_LAST,
+        idle_ttl_days: float = CHECKPOINT_IDLE_TTL_DAYS,
+        batch_threads: int = CHECKPOINT_PRUNE_BATCH_THREADS,
+        dry_run: bool = False,
+    ) -> PruneStats:
+        """Async variant of `prune`."""
+        stats = PruneStats()
+        grace_cutoff, idle_cutoff = self._prune_cutoffs(idle_ttl_days)
+        query = self._prune_query(dry_run)
+        last_thread_id = ""
+        while True:
+            async with self._get_async_connection() as conn:
+                async with conn.transaction():
+                    async with conn.cursor() as cur:
+                        await cur.execute(self.PRUNE_THREADS_PAGE_QUERY, (last_thread_id, batch_threads))
+                        page = await cur.fetchall()
+                        params = self._prune_params(page, keep_last, grace_cutoff, idle_cutoff, stats)
+                        if params is not None:
+                            await cur.execute(query, params)
+                            rows, size = await cur.fetchone()
+                            stats.rows_deleted += rows
+                            stats.bytes_freed += size
+            if not page:
+                return stats
+            if params is not None and not dry_run:
+                for thread_id in params["expired"]:
+                    self._forget_thread(thread_id)
+            last_thread_id = page[-1][0]
+
+    # Filter keys stored as columns; any other key is matched against the metadata.
+    FILTER_COLUMNS = ("tenant_id", "index_name")
 
     def _search_where(
         self,
@@ -483,8 +1196,10 @@ class PostgresSaver(BaseCheckpointSaver):
         """Return WHERE clause predicates for given config, filter, and before parameters.
         Args:
             config (Optional[RunnableConfig]): The config to use for filtering.
-            filter (Optional[Dict[str, Any]]): Additional filtering criteria.
-            before (Optional[RunnableConfig]): A config to limit results before a certain timestamp.
+            filter (Optional[Dict[str, Any]]): Additional filtering criteria: `tenant_id`,
+                `index_name`, or metadata values (e.g. {"source": "loop", "step": 3}).
+            before (Optional[RunnableConfig]): The last checkpoint of the previous page.
+                Results continue after it in (thread_ts, thread_id) order.
         Returns:
             Tuple[str, Sequence[Any]]: A tuple containing the WHERE clause and parameter values.
         """
@@ -497,12 +1212,26 @@ class PostgresSaver(BaseCheckpointSaver):
             param_values.append(config["configurable"]["thread_id"])
 
         if filter:
-            raise NotImplementedError()
+            metadata_filter = dict(filter)
+            for column in self.FILTER_COLUMNS:
+                if column in metadata_filter:
+                    wheres.append(f"{column} = %s")
+                    param_values.append(metadata_filter.pop(column))
+            if metadata_filter:
+                # Containment, answered from the GIN index.
+                wheres.append("metadata_json @> %s::jsonb")
+                param_values.append(json.dumps(metadata_filter))
 
-        # Add predicate for limiting results before a certain timestamp
+        # Keyset pagination: continue after the `before` checkpoint
         if before is not None:
-            wheres.append("thread_ts < %s")
-            param_values.append(before["configurable"]["thread_ts"])
+            before_ts = before["configurable"]["thread_ts"]
+            before_thread_id = before["configurable"].get("thread_id")
+            if config is None and before_thread_id is not None:
+                wheres.append("(thread_ts, thread_id) < (%s, %s)")
+                param_values.extend([before_ts, before_thread_id])
+            else:
+                wheres.append("thread_ts < %s")
+                param_values.append(before_ts)
 
         where_clause = "WHERE " + " AND ".join(wheres) if wheres else ""
-        return where_clause, param_values
\ No newline at end of file
+        return where_clause, param_values
@@ -0,0 +1,79 @@
+"""Checkpoint retention job.
+
+Runs `PostgresSaver.prune` on the checkpoints table, either from the command
+line (cron, a one-off cleanup) or periodically inside the API server when
+`CHECKPOINT_PRUNE_INTERVAL_SECONDS` is set:
+
+    python -m app.LLM.utilities.checkpoint_retention --keep-last 10 --idle-ttl-days 90 --dry-run
+
+Defaults come from `CHECKPOINT_KEEP_LAST`, `CHECKPOINT_IDLE_TTL_DAYS` and
+`CHECKPOINT_PRUNE_BATCH_THREADS`.
+"""
+from dotenv import load_dotenv, find_dotenv
+
+from app.LLM.utilities.checkpoint_memory import (
+    CHECKPOINT_IDLE_TTL_DAYS,
+    CHECKPOINT_KEEP_LAST,
+    CHECKPOINT_PRUNE_BATCH_THREADS,
+    PostgresSaver,
+    PruneStats,
+)
+
+import argparse
+import asyncio
+import os
+import time
+import traceback
+
+import psycopg
+
+load_dotenv(find_dotenv())
+
+# 0 disables the periodic job in the API server.
+CHECKPOINT_PRUNE_INTERVAL_SECONDS = float(os.getenv("CHECKPOINT_PRUNE_INTERVAL_SECONDS", "0"))
+
+
+def format_stats(stats: PruneStats, elapsed: float, dry_run: bool = False) -> str:
+    verb = "would delete" if dry_run else "deleted"
+    return (
+        f"checkpoint retention: scanned {stats.threads_scanned} threads, "
+        f"{stats.threads_expired} expired, {stats.threads_pruned} over the limit; "
+        f"{verb} {stats.rows_deleted} rows ({stats.bytes_freed / 1024 / 1024:.1f} MiB) in {elapsed:.1f}s"
+    )
+
+
+async def run_periodically(checkpointer: PostgresSaver, interval: float = CHECKPOINT_PRUNE_INTERVAL_SECONDS) -> None:
+    """Prune every `interval` seconds until cancelled. Started from the API server's lifespan."""
+    while True:
+        await asyncio.sleep(interval)
+        started = time.perf_counter()
+        try:
+            stats = await checkpointer.aprune()
+            print(format_stats(stats, time.perf_counter() - started))
+        except Exception:
+            # Retention is housekeeping; the next round tries again.
+            traceback.print_exc()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Delete old checkpoints.")
+    parser.add_argument("--keep-last", type=int, default=CHECKPOINT_KEEP_LAST,
+                        help="checkpoints kept per thread, 0 keeps all")
+    parser.add_argument("--idle-ttl-days", type=float, default=CHECKPOINT_IDLE_TTL_DAYS,
+                        help="delete threads idle for longer, 0 keeps them")
+    parser.add_argument("--batch-threads", type=int, default=CHECKPOINT_PRUNE_BATCH_THREADS,
+                        help="threads handled per transaction")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be deleted")
+    args = parser.parse_args()
+
+    with psycopg.connect(os.getenv("CHECKPOINT_MEMEORY_DB_URL"), autocommit=True) as conn:
+        PostgresSaver.create_tables(conn)
+        started = time.perf_counter()
+        stats = PostgresSaver(sync_connection=conn).prune(
+            keep_last=args.keep_last,
+            idle_ttl_days=args.idle_ttl_days,
+            batch_threads=args.batch_threads,
+            dry_run=args.dry_run,
+        )
+        print(format_stats(stats, time.perf_counter() - started, dry_run=args.dry_run))
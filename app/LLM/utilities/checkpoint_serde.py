@@ -0,0 +1,161 @@
+"""Serialization of checkpoint blobs for `PostgresSaver`.
+
+A blob is stored with a format tag such as "json", "msgpack" or
+"msgpack+zstd": the encoding, then the compression if any. Blobs are only
+compressed above `CHECKPOINT_COMPRESS_MIN_BYTES`, where it pays off. Rows
+written before the tag existed are plain "json" and keep loading.
+
+Objects are encoded the same way as `JsonPlusSerializer` does, so everything a
+checkpoint can hold round-trips in either encoding. An unknown
+`CHECKPOINT_FORMAT` or `CHECKPOINT_COMPRESSION` is an error, never a silent
+fallback: every process has to be able to read what the others write.
+
+Run this module to benchmark the formats on generated threads.
+"""
+from typing import Any, Optional
+
+from dotenv import load_dotenv, find_dotenv
+
+from langgraph.serde.jsonplus import JsonPlusSerializer
+
+import os
+import zlib
+
+import msgpack
+import zstandard
+
+load_dotenv(find_dotenv())
+
+CHECKPOINT_FORMAT = os.getenv("CHECKPOINT_FORMAT", "msgpack")
+# "zstd", "zlib" or "none".
+CHECKPOINT_COMPRESSION = os.getenv("CHECKPOINT_COMPRESSION", "zstd")
+CHECKPOINT_COMPRESS_MIN_BYTES = int(os.getenv("CHECKPOINT_COMPRESS_MIN_BYTES", "1024"))
+
+JSON = "json"
+MSGPACK = "msgpack"
+ZLIB = "zlib"
+ZSTD = "zstd"
+
+
+class CheckpointSerializer:
+    def __init__(
+        self,
+        format: str = CHECKPOINT_FORMAT,
+        compression: Optional[str] = CHECKPOINT_COMPRESSION,
+        compress_min_bytes: int = CHECKPOINT_COMPRESS_MIN_BYTES,
+    ):
+        if format not in (JSON, MSGPACK):
+            raise ValueError(f"Unknown checkpoint format: {format}")
+        if compression in ("", "none"):
+            compression = None
+        if compression not in (None, ZLIB, ZSTD):
+            raise ValueError(f"Unknown checkpoint compression: {compression}")
+        self.format = format
+        self.compression = compression
+        self.compress_min_bytes = compress_min_bytes
+        self._json = JsonPlusSerializer()
+        self._zstd_compressor = zstandard.ZstdCompressor(level=3)
+        self._zstd_decompressor = zstandard.ZstdDecompressor()
+
+    def _encode(self, obj: Any) -> bytes:
+        if self.format == MSGPACK:
+            return msgpack.packb(obj, default=self._json._default, use_bin_type=True)
+        return self._json.dumps(obj)
+
+    def _decode(self, format: str, data: bytes) -> Any:
+        if format == MSGPACK:
+            return msgpack.unpackb(data, object_hook=self._json._reviver, raw=False, strict_map_key=False)
+        if format == JSON:
+            return self._json.loads(data)
+        raise ValueError(f"Unknown checkpoint format: {format}")
+
+    def dumps(self, obj: Any) -> tuple[str, bytes]:
+        """Return the format tag and the encoded blob."""
+        data = self._encode(obj)
+        if self.compression is None or len(data) < self.compress_min_bytes:
+            return self.format, data
+        if self.compression == ZSTD:
+            return f"{self.format}+{ZSTD}", self._zstd_compressor.compress(data)
+        return f"{self.format}+{ZLIB}", zlib.compress(data, 6)
+
+    def loads(self, format: Optional[str], data: bytes) -> Any:
+        encoding, _, compression = (format or JSON).partition("+")
+        if compression == ZSTD:
+            data = self._zstd_decompressor.decompress(data)
+        elif compression == ZLIB:
+            data = zlib.decompress(data)
+        elif compression:
+            raise ValueError(f"Unknown checkpoint compression: {compression}")
+        return self._decode(encoding, bytes(data))
+
+
+if __name__ == "__main__":
+
+    # Benchmark: bytes per checkpoint and dumps/loads time for each format.
+
+    from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+    from langgraph.checkpoint.base import empty_checkpoint
+
+    import random
+    import time
+    import uuid
+
+    # Messages are drawn from a vocabulary, so no two are alike and compression
+    # gets no more help than on real threads.
+    vocabulary = (
+        "limousine sedan van bus party wedding airport transfer hotel downtown station pickup dropoff driver "
+        "chauffeur passengers luggage seats leather minibar champagne sound lights hourly rate minimum hours "
+        "flat fee deposit refund cancellation policy booking reservation confirm date time friday saturday "
+        "evening morning night noon tonight tomorrow week month prom birthday anniversary corporate event tour "
+        "wine vineyard concert stadium dinner restaurant club route stops waiting gratuity included tax total "
+        "price quote discount package premium standard black white stretch suv sprinter capacity available "
+        "sorry sure great thanks please could would like need want book change cancel extra free only also"
+    ).split()
+    rng = random.Random(0)
+
+    def text(words: int) -> str:
+        return " ".join(rng.choices(vocabulary, k=words)).capitalize() + "."
+
+    def make_checkpoint(turns: int) -> dict:
+        messages = []
+        for turn in range(turns):
+            call_id = f"call_{uuid.uuid4().hex[:24]}"
+            messages += [
+                HumanMessage(content=text(rng.randint(8, 30)), id=str(uuid.uuid4())),
+                AIMessage(
+                    content="",
+                    tool_calls=[{"name": "lookup_info", "args": {"query": text(5)}, "id": call_id}],
+                    id=str(uuid.uuid4()),
+                ),
+                ToolMessage(content=text(rng.randint(200, 600)), tool_call_id=call_id, name="lookup_info", id=str(uuid.uuid4())),
+                AIMessage(content=text(rng.randint(20, 80)), id=str(uuid.uuid4())),
+            ]
+        checkpoint = empty_checkpoint()
+        checkpoint["channel_values"] = {"messages": messages, "summary": "", "summary_message_count": 0}
+        checkpoint["channel_versions"] = {"messages": turns * 4, "summary": 1}
+        return checkpoint
+
+    serializers = {
+        "json": CheckpointSerializer(JSON, None),
+        "json+zlib": CheckpointSerializer(JSON, ZLIB),
+        "msgpack": CheckpointSerializer(MSGPACK, None),
+        "msgpack+zlib": CheckpointSerializer(MSGPACK, ZLIB),
+        "msgpack+zstd": CheckpointSerializer(MSGPACK, ZSTD),
+    }
+    repeat = 20
+
+    for turns in (5, 20, 50):
+        checkpoint = make_checkpoint(turns)
+        print(f"\n{turns} turns ({turns * 4} messages)")
+        print(f"{'format':<14}{'tag':<14}{'bytes':>10}{'dumps ms':>12}{'loads ms':>12}")
+        for name, serializer in serializers.items():
+            started = time.perf_counter()
+            for _ in range(repeat):
+                tag, data = serializer.dumps(checkpoint)
+            dumps_ms = (time.perf_counter() - started) / repeat * 1000
+            started = time.perf_counter()
+            for _ in range(repeat):
+                loaded = serializer.loads(tag, data)
+            loads_ms = (time.perf_counter() - started) / repeat * 1000
+            assert loaded["channel_values"]["messages"] == checkpoint["channel_values"]["messages"]
+            print(f"{name:<14}{tag:<14}{len(data):>10}{dumps_ms:>12.2f}{loads_ms:>12.2f}")
@@ -0,0 +1,95 @@
+"""Packing of retrieved chunks into the `lookup_info` tool output.
+
+Chunks come from the retriever best first. Exact duplicates are dropped, and
+the splitter's overlap between neighbouring chunks of the same page is cut
+(using the `start_index` the splitter records), so the same text is never
+sent twice. Chunks are then taken in order until `LOOKUP_TOKEN_BUDGET` tokens
+are used; the chunk that crosses the budget is truncated to fit.
+"""
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv, find_dotenv
+
+from langchain_core.documents import Document
+
+import os
+
+import tiktoken
+
+load_dotenv(find_dotenv())
+
+# About one chunk of the ingestion splitter (4000 tokens, see pipeline.py), a
+# quarter of the four whole chunks a lookup used to send. The tool output stays
+# in the thread history, so every later turn pays for it again.
+LOOKUP_TOKEN_BUDGET = int(os.getenv("LOOKUP_TOKEN_BUDGET", "4000"))
+# A truncated chunk shorter than this is not worth sending.
+_MIN_TRUNCATED_TOKENS = 50
+
+
+@lru_cache(maxsize=None)
+def _get_encoding() -> tiktoken.Encoding:
+    return tiktoken.encoding_for_model("gpt-4o")
+
+
+def count_tokens(text: str) -> int:
+    return len(_get_encoding().encode(text, disallowed_special=()))
+
+
+def _location(doc: Document) -> Optional[tuple]:
+    """Where the chunk sits in its source, if the splitter recorded it."""
+    if "start_index" not in doc.metadata:
+        return None
+    return (doc.metadata.get("source"), doc.metadata.get("page"), doc.metadata.get("row"))
+
+
+def _trim_overlap(text: str, start: int, taken: List[Tuple[int, int]]) -> Optional[str]:
+    """Cut the parts of `text` (at offset `start`) already covered by `taken` ranges; None if nothing is left."""
+    end = start + len(text)
+    for taken_start, taken_end in taken:
+        if taken_start <= start and end <= taken_end:
+            return None
+        if taken_start <= start < taken_end:
+            text, start = text[taken_end - start:], taken_end
+        elif taken_start < end <= taken_end:
+            text, end = text[:taken_start - start], taken_start
+    return text.strip() or None
+
+
+def pack_documents(docs: List[Document], token_budget: int = LOOKUP_TOKEN_BUDGET) -> Tuple[str, int]:
+    """Return the packed context and the number of tokens it uses."""
+    seen: set[str] = set()
+    taken: dict[tuple, List[Tuple[int, int]]] = {}
+    parts: List[str] = []
+    used = 0
+
+    for doc in docs:
+        text = doc.page_content
+        if text in seen:
+            continue
+        seen.add(text)
+
+        location = _location(doc)
+        token_count = doc.metadata.get("token_count")
+        if location is not None:
+            start = doc.metadata["start_index"]
+            trimmed = _trim_overlap(text, start, taken.get(location, []))
+            if trimmed is None:
+                continue
+            taken.setdefault(location, []).append((start, start + len(text)))
+            if trimmed != text:
+                text, token_count = trimmed, None
+        if token_count is None:
+            token_count = count_tokens(text)
+
+        remaining = token_budget - used
+        if token_count > remaining:
+            if remaining >= _MIN_TRUNCATED_TOKENS:
+                tokens = _get_encoding().encode(text, disallowed_special=())[:remaining]
+                parts.append(_get_encoding().decode(tokens))
+                used += remaining
+            break
+        parts.append(text)
+        used += token_count
+
+    return "\n\n".join(parts), used
@@ -0,0 +1,33 @@
+"""The one Langfuse client of the process, shared by prompt fetching and tracing.
+
+It is created on first use, so importing this module needs no Langfuse
+credentials. The client batches events and sends them from its own threads;
+`flush_langfuse` sends what is still buffered and is called on shutdown.
+"""
+from typing import Optional
+
+from dotenv import load_dotenv, find_dotenv
+
+from langfuse import Langfuse
+
+import threading
+
+load_dotenv(find_dotenv())
+
+_client: Optional[Langfuse] = None
+_lock = threading.Lock()
+
+
+def get_langfuse() -> Langfuse:
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = Langfuse()
+    return _client
+
+
+def flush_langfuse() -> None:
+    """Send buffered events, if the client was ever created."""
+    if _client is not None:
+        _client.flush()
@@ -0,0 +1,148 @@
+"""Bounded conversation memory for the assistant.
+
+The checkpointer keeps every message of a thread, but the assistant only sends
+the model a window of it:
+
+- tool outputs from before the latest user message are replaced by a short
+  placeholder (the `tool_call_id` is kept, the API requires it);
+- the window is the newest whole turns that fit in the tenant's history token
+  budget (`HISTORY_TOKEN_BUDGET`, per-tenant values in
+  `HISTORY_TOKEN_BUDGET_OVERRIDES`, keyed by `tenant_key`); the latest turn
+  is always kept;
+- older turns are represented by the thread's rolling `summary`, which
+  `summarize` refreshes in the background after a run. Until the summary
+  covers the turns that left the budget, the window reaches back to where the
+  summary ends, so no turn is in neither.
+"""
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv, find_dotenv
+
+from langchain_core.messages import AnyMessage, AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_openai import ChatOpenAI
+
+from app.LLM.utilities.context_packing import count_tokens
+
+import json
+import os
+
+load_dotenv(find_dotenv())
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "6000"))
+# JSON object of tenant key -> history token budget, e.g. {"<tenant_key(token)>": 12000}.
+HISTORY_TOKEN_BUDGET_OVERRIDES: dict[str, int] = json.loads(os.getenv("HISTORY_TOKEN_BUDGET_OVERRIDES", "{}"))
+# The summary is only refreshed once at least this many messages fell out of the window unsummarized.
+SUMMARY_MIN_NEW_MESSAGES = int(os.getenv("SUMMARY_MIN_NEW_MESSAGES", "6"))
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+
+# Per-message overhead of the chat format (role, separators), in tokens.
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = """Summarize the conversation between a customer and a customer support assistant below.
+Keep every fact the assistant may need later: the customer's name, what they asked for, details they gave
+(dates, quantities, contact information) and what was offered or agreed. Be concise.
+
+Summary so far:
+{summary}
+
+New messages:
+{messages}"""
+
+
+def get_history_budget(tenant_id: Optional[str]) -> int:
+    return HISTORY_TOKEN_BUDGET_OVERRIDES.get(tenant_id, HISTORY_TOKEN_BUDGET)
+
+
+def _message_tokens(message: AnyMessage) -> int:
+    content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+    tokens = count_tokens(content) + _MESSAGE_OVERHEAD_TOKENS
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        tokens += count_tokens(json.dumps(tool_call["args"]))
+    return tokens
+
+
+def _elide_old_tool_outputs(messages: List[AnyMessage]) -> List[AnyMessage]:
+    last_human = max((i for i, message in enumerate(messages) if isinstance(message, HumanMessage)), default=0)
+    return [
+        ToolMessage(
+            content=f"[{message.name or 'tool'} output from an earlier turn omitted]",
+            tool_call_id=message.tool_call_id,
+            name=message.name,
+            id=message.id,
+        )
+        if isinstance(message, ToolMessage) and i < last_human
+        else message
+        for i, message in enumerate(messages)
+    ]
+
+
+def _turn_starts(messages: List[AnyMessage]) -> List[int]:
+    return [i for i, message in enumerate(messages) if isinstance(message, HumanMessage)]
+
+
+def _window_start(elided: List[AnyMessage], budget: int) -> int:
+    turn_starts = _turn_starts(elided)
+    if not turn_starts:
+        return 0
+    tokens = [_message_tokens(message) for message in elided]
+    start = turn_starts[-1]
+    used = sum(tokens[start:])
+    for turn_start in reversed(turn_starts[:-1]):
+        turn_tokens = sum(tokens[turn_start:start])
+        if used + turn_tokens > budget:
+            break
+        used += turn_tokens
+        start = turn_start
+    return start
+
+
+def window_start(messages: List[AnyMessage], budget: int) -> int:
+    """
+    Index of the first message of the newest turns that fit in `budget`.
+
+    The window only starts at a user message, so an assistant tool call is
+    never separated from its tool output.
+    """
+    return _window_start(_elide_old_tool_outputs(messages), budget)
+
+
+def trim_history(
+    messages: List[AnyMessage], budget: int, summary: Optional[str] = None, summary_message_count: int = 0
+) -> List[AnyMessage]:
+    """The messages to send to the model: the summary if older turns were cut, then the window."""
+    elided = _elide_old_tool_outputs(messages)
+    start = _window_start(elided, budget)
+    if start > summary_message_count:
+        # The summary does not cover these turns yet: keep them, over budget, until it does.
+        start = max((i for i in _turn_starts(elided) if i <= summary_message_count), default=0)
+    window = elided[start:]
+    if start > 0 and summary:
+        return [SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")] + window
+    return window
+
+
+def needs_summary(messages: List[AnyMessage], budget: int, summary_message_count: int) -> Tuple[bool, int]:
+    """Whether enough messages fell out of the window since the last summary, and up to which index to summarize."""
+    start = window_start(messages, budget)
+    return start - summary_message_count >= SUMMARY_MIN_NEW_MESSAGES, start
+
+
+def _format_for_summary(messages: List[AnyMessage]) -> str:
+    lines = []
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            lines.append(f"Customer: {message.content}")
+        elif isinstance(message, AIMessage) and message.content:
+            lines.append(f"Assistant: {message.content}")
+    return "\n".join(lines)
+
+
+summary_llm = ChatOpenAI(model=SUMMARY_MODEL, temperature=0)
+
+
+async def summarize(summary: Optional[str], messages: List[AnyMessage]) -> str:
+    """Fold `messages` into the running `summary`. Tool calls and outputs are left out."""
+    response = await summary_llm.ainvoke(
+        SUMMARY_PROMPT.format(summary=summary or "(none)", messages=_format_for_summary(messages))
+    )
+    return response.content
@@ -0,0 +1,187 @@
+"""In-process cache of Langfuse prompts.
+
+`prompt_registry.get(name)` serves prompts from memory, keyed by
+(name, version, label), fetched with the shared client of langfuse_client.py.
+A prompt older than `PROMPT_CACHE_TTL_SECONDS` is still served while
+a background thread fetches the new one (stale-while-revalidate); if that
+fetch fails, the last good prompt keeps being served and the fetch is retried
+after `PROMPT_REFRESH_RETRY_SECONDS`. Only the very first fetch of a prompt
+waits on Langfuse, and only it can fail.
+
+The client is injectable, see the fake in `__main__`.
+"""
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Optional
+
+from dotenv import load_dotenv, find_dotenv
+
+from langfuse.model import ChatPromptClient, TextPromptClient
+
+from app.LLM.utilities.langfuse_client import get_langfuse
+
+import asyncio
+import os
+import threading
+import time
+import traceback
+import urllib.parse
+
+load_dotenv(find_dotenv())
+
+PROMPT_CACHE_TTL_SECONDS = float(os.getenv("PROMPT_CACHE_TTL_SECONDS", "300"))
+PROMPT_REFRESH_RETRY_SECONDS = float(os.getenv("PROMPT_REFRESH_RETRY_SECONDS", "30"))
+
+
+@dataclass
+class _CachedPrompt:
+    prompt: Any
+    refresh_at: float
+
+
+class PromptRegistry:
+    def __init__(
+        self,
+        client_factory: Callable[[], Any] = get_langfuse,
+        ttl: float = PROMPT_CACHE_TTL_SECONDS,
+        retry_after: float = PROMPT_REFRESH_RETRY_SECONDS,
+    ):
+        self.client_factory = client_factory
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.hits = 0
+        self.misses = 0
+        self.refresh_failures = 0
+        self._entries: dict[Hashable, _CachedPrompt] = {}
+        self._refreshing: set[Hashable] = set()
+        self._lock = threading.Lock()
+
+    def _fetch(self, key: tuple) -> Any:
+        name, version, label = key
+        # Straight to the prompts API rather than get_prompt: when a fetch fails, the SDK's
+        # cache hands back its expired copy instead of raising, so a failure would go unnoticed.
+        response = self.client_factory().client.prompts.get(urllib.parse.quote(name), version=version, label=label)
+        return ChatPromptClient(response) if response.type == "chat" else TextPromptClient(response)
+
+    def _refresh(self, key: tuple) -> None:
+        try:
+            prompt = self._fetch(key)
+            with self._lock:
+                self._entries[key] = _CachedPrompt(prompt, time.monotonic() + self.ttl)
+        except Exception:
+            # Keep serving the last good prompt; try again later.
+            traceback.print_exc()
+            with self._lock:
+                self.refresh_failures += 1
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.refresh_at = time.monotonic() + self.retry_after
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _cached(self, key: tuple) -> Optional[Any]:
+        """The cached prompt, starting a background refresh if it is stale; None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if entry.refresh_at <= time.monotonic() and key not in self._refreshing:
+                self._refreshing.add(key)
+                threading.Thread(target=self._refresh, args=(key,), daemon=True).start()
+            return entry.prompt
+
+    def _store(self, key: tuple, prompt: Any) -> None:
+        with self._lock:
+            self._entries[key] = _CachedPrompt(prompt, time.monotonic() + self.ttl)
+
+    def get(self, name: str, version: Optional[int] = None, label: Optional[str] = None) -> Any:
+        """The Langfuse prompt client. Without version or label, Langfuse serves the "production" label."""
+        key = (name, version, label)
+        prompt = self._cached(key)
+        if prompt is None:
+            prompt = self._fetch(key)
+            self._store(key, prompt)
+        return prompt
+
+    async def aget(self, name: str, version: Optional[int] = None, label: Optional[str] = None) -> Any:
+        """Async variant of `get`: a first fetch runs in a worker thread."""
+        key = (name, version, label)
+        prompt = self._cached(key)
+        if prompt is None:
+            prompt = await asyncio.to_thread(self._fetch, key)
+            self._store(key, prompt)
+        return prompt
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """Forget the cached versions of a prompt, or of every prompt."""
+        with self._lock:
+            for key in [key for key in self._entries if name is None or key[0] == name]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "prompts": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "refresh_failures": self.refresh_failures,
+            }
+
+
+prompt_registry = PromptRegistry()
+
+
+if __name__ == "__main__":
+
+    # For local testing: a fake Langfuse client that can be taken offline.
+
+    from langfuse.api.resources.prompts.types import Prompt_Text
+
+    class FakeLangfuse:
+        def __init__(self):
+            self.client = self
+            self.prompts = self
+            self.version = 1
+            self.online = True
+            self.calls = 0
+
+        def get(self, name, *, version=None, label=None):
+            self.calls += 1
+            time.sleep(0.05)
+            if not self.online:
+                raise ConnectionError("Langfuse is unreachable")
+            return Prompt_Text(
+                type="text",
+                name=name,
+                version=self.version,
+                prompt="You are the assistant of {{business_name}} (v%d)." % self.version,
+                config={},
+                labels=["production"],
+                tags=[],
+            )
+
+    fake = FakeLangfuse()
+    registry = PromptRegistry(client_factory=lambda: fake, ttl=0.2, retry_after=0.2)
+
+    started = time.perf_counter()
+    print(registry.get("chatbot_onboarding_prompt").compile(business_name="Star Limo"),
+          f"(first fetch {1000 * (time.perf_counter() - started):.0f} ms)")
+    started = time.perf_counter()
+    for _ in range(1000):
+        registry.get("chatbot_onboarding_prompt")
+    print(f"1000 cached gets: {1000 * (time.perf_counter() - started):.1f} ms, {fake.calls} fetch")
+
+    fake.version = 2
+    time.sleep(0.25)
+    print("stale, served while refreshing:", registry.get("chatbot_onboarding_prompt").version)
+    time.sleep(0.1)
+    print("refreshed:", registry.get("chatbot_onboarding_prompt").version)
+
+    fake.online = False
+    time.sleep(0.25)
+    registry.get("chatbot_onboarding_prompt")
+    time.sleep(0.1)
+    print("Langfuse down, last good version:", registry.get("chatbot_onboarding_prompt").version)
+    print(registry.stats())
@@ -0,0 +1,33 @@
+"""Non-secret tenant ids.
+
+A tenant authenticates with its bearer token. Everything that identifies a
+tenant outside the request uses `tenant_key(token)` instead: the tenant
+columns of checkpoints, checkpoint_threads, chatbot_prompts and ingest_jobs,
+trace user ids, and configuration (`TRACE_SAMPLE_RATE_OVERRIDES`,
+`HISTORY_TOKEN_BUDGET_OVERRIDES`). The routers hash the token once, and
+everything below them only sees the key.
+
+Index names are the exception: Qdrant collections are named
+"<token>-<index name>", so the token is part of every stored index name.
+
+Run this module to print the key of a token: python -m app.LLM.utilities.tenants <token>
+"""
+from typing import Optional
+
+import hashlib
+
+TENANT_KEY_LENGTH = 16
+
+
+def tenant_key(tenant_id: Optional[str]) -> Optional[str]:
+    """First 16 hex digits of the sha256 of the tenant's token; None without a token."""
+    if tenant_id is None:
+        return None
+    return hashlib.sha256(tenant_id.encode()).hexdigest()[:TENANT_KEY_LENGTH]
+
+
+if __name__ == "__main__":
+
+    import sys
+
+    print(tenant_key(sys.argv[1]))
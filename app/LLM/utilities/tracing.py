@@ -0,0 +1,175 @@
+"""Sampled Langfuse tracing of chat runs.
+
+Only a sample of conversations is traced in full: a thread is sampled when
+its id hashes below the tenant's rate (`TRACE_SAMPLE_RATE`, per-tenant values
+in `TRACE_SAMPLE_RATE_OVERRIDES`), so a sampled conversation is traced turn
+after turn. Tenants are identified by `tenant_key`, never by their token, both
+in the overrides and as the trace's user id. A sampled run gets a Langfuse callback handler hanging off the shared client
+of langfuse_client.py, which batches events and sends them from its own threads.
+
+An unsampled run gets no callbacks at all, so LangChain does no tracing work
+for it. It is only timed: if it fails or takes longer than
+`TRACE_LATENCY_THRESHOLD_SECONDS`, a summary trace (input, output, error,
+latency) is still recorded.
+
+Run this module for a microbenchmark of the per-request overhead.
+"""
+from typing import Any, Callable, List, Optional
+
+from dotenv import load_dotenv, find_dotenv
+
+from app.LLM.utilities.langfuse_client import get_langfuse
+
+import hashlib
+import json
+import os
+import time
+import traceback
+
+load_dotenv(find_dotenv())
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+# JSON object of tenant key -> sample rate, e.g. {"<tenant_key(token)>": 1.0}.
+TRACE_SAMPLE_RATE_OVERRIDES: dict[str, float] = json.loads(os.getenv("TRACE_SAMPLE_RATE_OVERRIDES", "{}"))
+TRACE_LATENCY_THRESHOLD_SECONDS = float(os.getenv("TRACE_LATENCY_THRESHOLD_SECONDS", "20"))
+
+
+def _sample_point(thread_id: str) -> float:
+    """Position of the thread in [0, 1), stable across turns and processes."""
+    return int(hashlib.sha1(thread_id.encode()).hexdigest()[:8], 16) / 2**32
+
+
+class TracedRun:
+    """One chat run. Pass `callbacks` to the graph and set `output` before the block exits."""
+
+    __slots__ = ("tracer", "name", "session_id", "user_id", "input", "output", "callbacks", "_trace", "_started")
+
+    def __init__(self, tracer: "Tracer", name: str, session_id: str, user_id: Optional[str], input: Any):
+        self.tracer = tracer
+        self.name = name
+        self.session_id = session_id
+        self.user_id = user_id
+        self.input = input
+        self.output = None
+        self.callbacks: List[Any] = []
+        self._trace = None
+        self._started = 0.0
+
+    def __enter__(self) -> "TracedRun":
+        self._started = time.perf_counter()
+        if self.tracer.is_sampled(self.session_id, self.user_id):
+            try:
+                self._trace = self.tracer.client.trace(
+                    name=self.name, session_id=self.session_id, user_id=self.user_id, input=self.input
+                )
+                self.callbacks = [self._trace.get_langchain_handler()]
+            except Exception:
+                # Tracing must never fail a chat run.
+                traceback.print_exc()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        latency = time.perf_counter() - self._started
+        # Cancellations and closed streams (client disconnects) are not errors.
+        if not isinstance(exc, Exception):
+            exc = None
+        reason = "error" if exc is not None else "latency" if latency > self.tracer.latency_threshold else None
+        if self._trace is None and reason is None:
+            return
+        metadata = {"latency_seconds": round(latency, 3), "sampled": self._trace is not None}
+        if exc is not None:
+            metadata["error"] = f"{type(exc).__name__}: {exc}"
+        try:
+            if self._trace is not None:
+                self._trace.update(output=self.output, metadata=metadata, tags=[reason] if reason else None)
+            else:
+                self.tracer.client.trace(
+                    name=self.name,
+                    session_id=self.session_id,
+                    user_id=self.user_id,
+                    input=self.input,
+                    output=self.output,
+                    metadata=metadata,
+                    tags=[reason],
+                )
+        except Exception:
+            traceback.print_exc()
+
+
+class Tracer:
+    def __init__(
+        self,
+        client_factory: Callable[[], Any] = get_langfuse,
+        sample_rate: float = TRACE_SAMPLE_RATE,
+        sample_rate_overrides: Optional[dict[str, float]] = None,
+        latency_threshold: float = TRACE_LATENCY_THRESHOLD_SECONDS,
+    ):
+        self.client_factory = client_factory
+        self.sample_rate = sample_rate
+        self.sample_rate_overrides = (
+            TRACE_SAMPLE_RATE_OVERRIDES if sample_rate_overrides is None else sample_rate_overrides
+        )
+        self.latency_threshold = latency_threshold
+
+    @property
+    def client(self) -> Any:
+        return self.client_factory()
+
+    def is_sampled(self, session_id: str, user_id: Optional[str] = None) -> bool:
+        """Whether to trace the thread in full; `user_id` is the tenant's `tenant_key`."""
+        rate = self.sample_rate_overrides.get(user_id, self.sample_rate)
+        return rate > 0 and _sample_point(session_id) < rate
+
+    def trace(self, name: str, session_id: str, tenant_id: Optional[str] = None, input: Any = None) -> TracedRun:
+        """Context manager around a chat run, see `TracedRun`. `tenant_id` is the tenant's `tenant_key`."""
+        return TracedRun(self, name, session_id, tenant_id, input)
+
+
+tracer = Tracer()
+
+
+if __name__ == "__main__":
+
+    # Microbenchmark: what tracing adds to a request, on a small LangChain run.
+    # Langfuse points at an unreachable host; events are only queued.
+
+    from langchain_core.runnables import RunnableLambda
+    from langfuse import Langfuse
+    from langfuse.callback import CallbackHandler
+
+    import logging
+
+    logging.getLogger("langfuse").setLevel(logging.CRITICAL)
+
+    credentials = {"public_key": "pk-lf-bench", "secret_key": "sk-lf-bench", "host": "http://127.0.0.1:9"}
+    chain = RunnableLambda(lambda x: x + 1) | RunnableLambda(lambda x: x * 2) | RunnableLambda(lambda x: x - 1)
+    requests = 300
+
+    def bench(label: str, run_once: Callable[[int], None], count: int = requests) -> float:
+        started = time.perf_counter()
+        for i in range(count):
+            run_once(i)
+        per_request_ms = (time.perf_counter() - started) / count * 1000
+        print(f"{label:<48}{per_request_ms:>8.3f} ms/request")
+        return per_request_ms
+
+    baseline = bench("no tracing", lambda i: chain.invoke(i))
+    bench(
+        "new CallbackHandler per request (before)",
+        lambda i: chain.invoke(i, {"callbacks": [CallbackHandler(session_id=str(i), **credentials)]}),
+        count=20,  # every handler starts its own client and sender threads
+    )
+
+    client = Langfuse(**credentials)
+    for rate in (1.0, 0.1, 0.0):
+        sampled = Tracer(lambda: client, sample_rate=rate, sample_rate_overrides={})
+
+        def run_once(i: int) -> None:
+            with sampled.trace("bench", session_id=f"thread-{i}", input=i) as run:
+                run.output = chain.invoke(i, {"callbacks": run.callbacks})
+
+        bench(f"sampled tracer, rate {rate:g}", run_once)
+
+    print(f"(baseline {baseline:.3f} ms/request)")
+    # Skip flushing the queued events to the unreachable host on exit.
+    os._exit(0)
@@ -1,3 +1,5 @@
+from contextlib import asynccontextmanager
+
 from fastapi import Depends, FastAPI, File, Form, HTTPException
 from fastapi.responses import RedirectResponse
 
@@ -5,16 +7,54 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from app.backend.router import vectors_store
 from app.backend.router import query_llm
+from app.backend.router import threads
+from app.LLM.graph.graph import async_pool, checkpointer
+from app.LLM.utilities.checkpoint_retention import CHECKPOINT_PRUNE_INTERVAL_SECONDS, run_periodically
+from app.LLM.utilities.langfuse_client import flush_langfuse
+from app.vectors_store.ingestion.loaders import shutdown_parse_pool
 
 
 from dotenv import load_dotenv, find_dotenv
 
+import asyncio
+import traceback
+
 load_dotenv(find_dotenv())
 
 
+async def _backfill_checkpoints() -> None:
+    # Searchable columns of checkpoints written before they existed; a no-op once done.
+    try:
+        updated = await checkpointer.abackfill()
+        if updated:
+            print(f"checkpoint backfill: {updated} rows updated")
+    except Exception:
+        traceback.print_exc()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The async checkpointer pool has to be opened inside the server's event loop.
+    await async_pool.open()
+    vectors_store.ingest_queue.start()
+    backfill_task = asyncio.create_task(_backfill_checkpoints())
+    retention_task = None
+    if CHECKPOINT_PRUNE_INTERVAL_SECONDS > 0:
+        retention_task = asyncio.create_task(run_periodically(checkpointer))
+    yield
+    backfill_task.cancel()
+    if retention_task is not None:
+        retention_task.cancel()
+    vectors_store.ingest_queue.stop(timeout=5)
+    shutdown_parse_pool()
+    flush_langfuse()
+    await async_pool.close()
+
+
 app = FastAPI(title="Rasi LLM APIs",
     version="1.0",
-    description="APIs server")
+    description="APIs server",
+    lifespan=lifespan)
 
 
 allowed_origins = [
@@ -33,6 +73,7 @@ app.add_middleware(
 
 app.include_router(vectors_store.router, tags=["vectors_store"])
 app.include_router(query_llm.router, tags=["query_llm"])
+app.include_router(threads.router, tags=["threads"])
 # app.add_exception_handler(HTTPException, custom_http_exception_handler)
 
 @app.get("/", tags=["root"])
@@ -1,16 +1,17 @@
-from typing import Annotated
+from typing import Annotated, Optional
 from fastapi import APIRouter, HTTPException, Request, Depends, Form, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import requests
+import json
 import os
 from dotenv import load_dotenv, find_dotenv
 from supabase import create_client, Client
 
 from pydantic import BaseModel
 
-from langfuse import Langfuse
-
-from app.LLM.graph.graph import query_llm
+from app.LLM.graph.graph import aquery_llm, astream_llm, chatbot_prompts, checkpointer
+from app.LLM.utilities.prompt_registry import prompt_registry
+from app.LLM.utilities.tenants import tenant_key
 from app.backend.utilities.utilities import verify_token
 
 load_dotenv(find_dotenv())
@@ -63,10 +64,8 @@ async def create_chatbot_prompt(
             headers={"WWW-Authenticate": "Bearer"},
         )
     try:
-        # Initialize Langfuse client
-        langfuse = Langfuse()
-        # Get current production version
-        langfuse_prompt = langfuse.get_prompt("chatbot_onboarding_prompt")
+        # Current production version, served from memory and refreshed in the background
+        langfuse_prompt = await prompt_registry.aget("chatbot_onboarding_prompt")
         
         str_prompt = langfuse_prompt.compile(
                 name=prompt_items.name,
@@ -85,12 +84,58 @@ async def create_chatbot_prompt(
 
 
 
+@router.post("/api/v1/chatbot_prompts/")
+async def register_chatbot_prompt(
+    prompt: Annotated[str, Form()],
+    index_name: Annotated[str, Form()],
+    token: str = Depends(get_bearer_token),
+):
+    """Store a system prompt for the index; chat requests can then send its `prompt_id` instead of the text."""
+    if not verify_token(token):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    prompt_id = await chatbot_prompts.aregister(tenant_id=tenant_key(token), index_name=index_name, prompt=prompt)
+    return JSONResponse(status_code=200, content={"prompt_id": prompt_id})
+
+
+async def _resolve_prompt(token: str, index_name: str, prompt: Optional[str], prompt_id: Optional[str]) -> str:
+    """The system prompt of a chat request: registered under `prompt_id`, or sent as `prompt`."""
+    if prompt_id:
+        stored = await chatbot_prompts.aget(tenant_id=tenant_key(token), index_name=index_name, prompt_id=prompt_id)
+        if stored is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Prompt {prompt_id} not found for index {index_name}",
+            )
+        return stored
+    if not prompt:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Either prompt or prompt_id is required",
+        )
+    return prompt
+
+
+async def _check_thread_owner(token: str, thread_id: str) -> None:
+    """404 for a thread of another tenant, as if it did not exist."""
+    if await checkpointer.athread_belongs_to_other(thread_id, tenant_key(token)):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Thread {thread_id} not found",
+        )
+
+
 @router.post("/api/v1/query_llm/")
 async def chat_with_llm(
     query: Annotated[str, Form()],
-    prompt: Annotated[str, Form()],
     index_name: Annotated[str, Form()],
     thread_id: Annotated[str, Form()],
+    prompt: Annotated[Optional[str], Form()] = None,
+    prompt_id: Annotated[Optional[str], Form()] = None,
+    use_answer_cache: Annotated[bool, Form()] = False,
     token: str = Depends(get_bearer_token),
 ):  
     if not verify_token(token):
@@ -99,9 +144,62 @@ async def chat_with_llm(
             detail="Invalid or expired token",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    await _check_thread_owner(token, thread_id)
+    prompt = await _resolve_prompt(token, index_name, prompt, prompt_id)
     try:
-        response = query_llm(query=query, index_name=f"{token}-{index_name}", thread_id=thread_id, prompt=prompt)
+        response = await aquery_llm(
+            query=query,
+            index_name=f"{token}-{index_name}",
+            thread_id=thread_id,
+            prompt=prompt,
+            use_answer_cache=use_answer_cache,
+            tenant_id=tenant_key(token),
+        )
         final_response = JSONResponse(status_code=200, content=response['messages'][-1].content)
         return final_response
     except requests.exceptions.RequestException as err:
         return JSONResponse(status_code=400, content={f"error: Error occurred during query: {str(err)}"})
+
+
+def _format_sse(event: dict) -> str:
+    return f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+@router.post("/api/v1/query_llm/stream")
+async def stream_chat_with_llm(
+    query: Annotated[str, Form()],
+    index_name: Annotated[str, Form()],
+    thread_id: Annotated[str, Form()],
+    prompt: Annotated[Optional[str], Form()] = None,
+    prompt_id: Annotated[Optional[str], Form()] = None,
+    tool_events: Annotated[bool, Form()] = False,
+    token: str = Depends(get_bearer_token),
+):
+    if not verify_token(token):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    await _check_thread_owner(token, thread_id)
+    prompt = await _resolve_prompt(token, index_name, prompt, prompt_id)
+
+    async def event_stream():
+        try:
+            async for event in astream_llm(
+                query=query,
+                index_name=f"{token}-{index_name}",
+                thread_id=thread_id,
+                prompt=prompt,
+                include_tool_events=tool_events,
+                tenant_id=tenant_key(token),
+            ):
+                yield _format_sse(event)
+        except Exception as err:
+            yield _format_sse({"event": "error", "data": f"Error occurred during query: {str(err)}"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
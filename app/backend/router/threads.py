@@ -0,0 +1,178 @@
+"""Read-only access to a tenant's conversations.
+
+Threads are listed from the per-thread checkpoint_threads table, and a thread's
+messages come from its latest checkpoint only (one snapshot plus its deltas),
+never from its whole checkpoint history. Both endpoints page backwards with a
+`before` cursor, or stream everything as NDJSON with `format=ndjson`.
+"""
+from datetime import datetime
+from typing import AsyncIterator, Literal, Optional
+
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, status
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from langchain_core.messages import AnyMessage
+
+from app.LLM.graph.graph import checkpointer
+from app.LLM.utilities.tenants import tenant_key
+from app.backend.utilities.utilities import verify_token
+
+import base64
+import json
+import os
+
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+THREADS_PAGE_SIZE = int(os.getenv("THREADS_PAGE_SIZE", "50"))
+MESSAGES_PAGE_SIZE = int(os.getenv("MESSAGES_PAGE_SIZE", "100"))
+# Threads read per query while streaming a tenant's thread list.
+_STREAM_PAGE_SIZE = 500
+
+
+router = APIRouter()
+
+def get_bearer_token(request: Request) -> str:
+    auth_header = request.headers.get("Authorization")
+    if auth_header:
+        try:
+            scheme, token = auth_header.split()
+            if scheme.lower() != "bearer":
+                raise ValueError("Invalid scheme")
+            return token
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid authorization header format"
+            )
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authorization header missing",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+def _encode_cursor(updated_at: datetime, thread_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([updated_at.isoformat(), thread_id]).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        updated_at, thread_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(updated_at), thread_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def _thread_to_dict(row: tuple, token: str) -> dict:
+    thread_id, index_name, created_at, updated_at = row
+    # Indexes are stored as "<token>-<index name>", see query_llm.py.
+    if index_name and index_name.startswith(f"{token}-"):
+        index_name = index_name[len(token) + 1:]
+    return {
+        "thread_id": thread_id,
+        "index_name": index_name,
+        "created_at": created_at.isoformat(),
+        "updated_at": updated_at.isoformat(),
+    }
+
+
+def _message_to_dict(index: int, message: AnyMessage) -> dict:
+    item = {"index": index, "id": message.id, "type": message.type, "content": message.content}
+    if getattr(message, "tool_calls", None):
+        item["tool_calls"] = [{"name": call["name"], "args": call["args"]} for call in message.tool_calls]
+    if message.type == "tool":
+        item["name"] = message.name
+    return item
+
+
+async def _ndjson(items: AsyncIterator[dict]) -> AsyncIterator[str]:
+    async for item in items:
+        yield json.dumps(item) + "\n"
+
+
+@router.get("/api/v1/threads")
+async def list_threads(
+    before: Optional[str] = None,
+    limit: int = Query(THREADS_PAGE_SIZE, ge=1, le=1000),
+    format: Literal["json", "ndjson"] = "json",
+    token: str = Depends(get_bearer_token),
+):
+    """Threads of the business owner, most recently active first. `ndjson` streams all of them from `before` on."""
+    if not verify_token(token):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    cursor = _decode_cursor(before) if before else None
+
+    if format == "ndjson":
+        async def threads() -> AsyncIterator[dict]:
+            page_cursor = cursor
+            while True:
+                rows = await checkpointer.alist_threads(tenant_key(token), before=page_cursor, limit=_STREAM_PAGE_SIZE)
+                for row in rows:
+                    yield _thread_to_dict(row, token)
+                if len(rows) < _STREAM_PAGE_SIZE:
+                    return
+                page_cursor = (rows[-1][3], rows[-1][0])
+
+        return StreamingResponse(_ndjson(threads()), media_type="application/x-ndjson")
+
+    rows = await checkpointer.alist_threads(tenant_key(token), before=cursor, limit=limit)
+    next_cursor = _encode_cursor(rows[-1][3], rows[-1][0]) if len(rows) == limit else None
+    return JSONResponse(
+        status_code=200,
+        content={"threads": [_thread_to_dict(row, token) for row in rows], "next_cursor": next_cursor},
+    )
+
+
+@router.get("/api/v1/threads/{thread_id}/messages")
+async def list_thread_messages(
+    thread_id: str,
+    before: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+    format: Literal["json", "ndjson"] = "json",
+    token: str = Depends(get_bearer_token),
+):
+    """
+    Messages of a thread in conversation order.
+
+    A page holds the `limit` messages before position `before` (default: the
+    newest ones); `next_cursor` is the `before` of the previous page. `ndjson`
+    streams every message before `before` unless `limit` is given.
+    """
+    if not verify_token(token):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if not await checkpointer.athread_belongs_to(thread_id, tenant_key(token)):
+        return JSONResponse(status_code=404, content={"error": f"Thread {thread_id} not found"})
+
+    latest = await checkpointer.aget_tuple({"configurable": {"thread_id": thread_id}})
+    messages = latest.checkpoint["channel_values"].get("messages", []) if latest else []
+    end = min(before, len(messages)) if before is not None else len(messages)
+
+    if format == "ndjson":
+        start = max(0, end - limit) if limit else 0
+
+        async def items() -> AsyncIterator[dict]:
+            for index in range(start, end):
+                yield _message_to_dict(index, messages[index])
+
+        return StreamingResponse(_ndjson(items()), media_type="application/x-ndjson")
+
+    start = max(0, end - (limit or MESSAGES_PAGE_SIZE))
+    return JSONResponse(
+        status_code=200,
+        content={
+            "thread_id": thread_id,
+            "messages": [_message_to_dict(index, messages[index]) for index in range(start, end)],
+            "next_cursor": start if start > 0 else None,
+        },
+    )
@@ -2,14 +2,11 @@ from typing import Annotated
 
 from fastapi.security import OAuth2PasswordBearer
 
-from app.backend.utilities.utilities import verify_token
-from app.vectors_store.ingestion.ingest_json import ingest_json
-from app.vectors_store.ingestion.ingest_csv import ingest_csv
-from app.vectors_store.ingestion.ingest_pdf import ingest_pdf
-from app.vectors_store.ingestion.ingest_txt import ingest_txt
-from app.vectors_store.ingestion.ingest_excel import ingest_excel
-from app.vectors_store.ingestion.ingest_ppt import ingest_ppt
-from app.vectors_store.ingestion.ingest_doc import ingest_doc
+from app.backend.utilities.utilities import verify_token, save_upload_file, remove_upload_file
+from app.backend.utilities.ingest_jobs import IngestFile, IngestJobQueue, IngestJobStore, QueueFullError
+from app.LLM.utilities.tenants import tenant_key
+from app.vectors_store.ingestion.loaders import LoaderSpec, find_loader, get_loader
+from app.vectors_store.ingestion.pipeline import ingest_files
 from app.vectors_store.delete_vectors.delete_vectors import delete_all_vectors
 
 import requests
@@ -54,6 +51,71 @@ def get_bearer_token(request: Request) -> str:
         )
 
 
+MAX_FILES_PER_UPLOAD = int(os.getenv("MAX_FILES_PER_UPLOAD", "20"))
+
+ingest_queue = IngestJobQueue(
+    IngestJobStore(),
+    runner=ingest_files,
+    cleanup=remove_upload_file,
+)
+
+
+async def _enqueue_ingestion(token: str, index_name: str, uploads: list[tuple[UploadFile, LoaderSpec]]) -> JSONResponse:
+    """Save the uploads and queue them as a single ingestion job."""
+    files = []
+    try:
+        for upload, spec in uploads:
+            file_path = await save_upload_file(upload)
+            files.append(IngestFile(name=upload.filename, path=file_path, kind=spec.kind))
+        job = ingest_queue.submit(
+            tenant=tenant_key(token), index_name=index_name, collection=f"{token}-{index_name}", files=files
+        )
+    except BaseException as err:
+        for file in files:
+            remove_upload_file(file.path)
+        if isinstance(err, QueueFullError):
+            return JSONResponse(status_code=429, content={"error": str(err)})
+        raise
+    file_names = ", ".join(file.name for file in files)
+    return JSONResponse(
+        status_code=202,
+        content={
+            "job_id": job.id,
+            "status_url": f"/api/v1/ingest_jobs/{job.id}",
+            "message": f"file name - {file_names} queued for ingestion",
+        },
+    )
+
+
+async def _upsert_file(file: UploadFile, index_name: str, token: str, kind: str) -> JSONResponse:
+    spec = get_loader(kind)
+    if file.content_type not in spec.content_types:
+        return JSONResponse(status_code=400, content={"error": f"Only {spec.label} is supported"})
+    return await _enqueue_ingestion(token=token, index_name=index_name, uploads=[(file, spec)])
+
+
+# Ingest any mix of supported files as one batch
+@router.post("/api/v1/upsert_files/")
+async def upsert_files(
+    files: Annotated[list[UploadFile], File()],
+    index_name: Annotated[str, Form()],
+    token: str = Depends(get_bearer_token),
+):
+    if not verify_token(token):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if len(files) > MAX_FILES_PER_UPLOAD:
+        return JSONResponse(status_code=400, content={"error": f"At most {MAX_FILES_PER_UPLOAD} files can be uploaded at once"})
+    uploads = [(file, find_loader(file.filename, file.content_type)) for file in files]
+    unsupported = [file.filename for file, spec in uploads if spec is None]
+    if unsupported:
+        return JSONResponse(status_code=400, content={"error": f"Unsupported file type: {', '.join(unsupported)}"})
+    return await _enqueue_ingestion(token=token, index_name=index_name, uploads=uploads)
+
+
 # Ingest CSV
 @router.post("/api/v1/upsert_csv/")
 async def upsert_csv(
@@ -67,21 +129,7 @@ async def upsert_csv(
             detail="Invalid or expired token",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    if file.content_type != "text/csv":
-        return JSONResponse(status_code=400, content={"error": "Only CSV file is supported"})
-    try:
-        contents = await file.read()
-        with open(f"{file.filename}","wb") as tmp:
-            tmp.write(contents)
-    except requests.exceptions.RequestException as err:
-        return {"error": f"Error occurred during file upload: {str(err)}"}
-    try:
-        indexing_stats = ingest_csv(file_path=f"{file.filename}", index_name=f"{token}-{index_name}")
-        os.remove(f"{file.filename}")
-        final_response = JSONResponse(status_code=200, content=f"file name - {file.filename} uploaded successfully with the following stats: {indexing_stats}")
-        return final_response
-    except requests.exceptions.RequestException as err:
-        return JSONResponse(status_code=400, content={f"error: Error occurred during file upload: {str(err)}"})
+    return await _upsert_file(file=file, index_name=index_name, token=token, kind="csv")
 
 # Ingest JSON
 @router.post("/api/v1/upsert_json/")
@@ -96,22 +144,7 @@ async def upsert_json(
             detail="Invalid or expired token",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    if file.content_type != "application/json":
-        return JSONResponse(status_code=400, content={"error": "Only JSON file is supported"})
-    try:
-        contents = await file.read()
-        with open(f"{file.filename}","wb") as tmp:
-            tmp.write(contents)
-    except requests.exceptions.RequestException as err:
-        return {"error": f"Error occurred during file upload: {str(err)}"}
-    try:
-        indexing_stats = ingest_json(file_path=f"{file.filename}", index_name=f"{token}-{index_name}")
-        os.remove(f"{file.filename}")
-        final_response = JSONResponse(status_code=200, content=f"file name - {file.filename} uploaded successfully with the following stats: {indexing_stats}")
-        return final_response
-        
-    except requests.exceptions.RequestException as err:
-        return JSONResponse(status_code=400, content={f"error: Error occurred during file upload: {str(err)}"})
+    return await _upsert_file(file=file, index_name=index_name, token=token, kind="json")
 
 # Ingest PDF
 @router.post("/api/v1/upsert_pdf/")
@@ -126,21 +159,7 @@ async def upsert_pdf(
             detail="Invalid or expired token",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    if file.content_type != "application/pdf":
-        return JSONResponse(status_code=400, content={"error": "Only PDF file is supported"})
-    try:
-        contents = await file.read()
-        with open(f"{file.filename}","wb") as tmp:
-            tmp.write(contents)
-    except requests.exceptions.RequestException as err:
-        return {"error": f"Error occurred during file upload: {str(err)}"}
-    try:
-        indexing_stats = ingest_pdf(file_path=f"{file.filename}", index_name=f"{token}-{index_name}")
-        os.remove(f"{file.filename}")
-        final_response = JSONResponse(status_code=200, content=f"file name - {file.filename} uploaded successfully with the following stats: {indexing_stats}")
-        return final_response
-    except requests.exceptions.RequestException as err:
-        return JSONResponse(status_code=400, content={f"error: Error occurred during file upload: {str(err)}"})
+    return await _upsert_file(file=file, index_name=index_name, token=token, kind="pdf")
 
 # Ingest TXT
 @router.post("/api/v1/upsert_txt/")
@@ -155,21 +174,7 @@ async def upsert_txt(
             detail="Invalid or expired token",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    if file.content_type != "text/plain":
-        return JSONResponse(status_code=400, content={"error": "Only TXT file is supported"})
-    try:
-        contents = await file.read()
-        with open(f"{file.filename}","wb") as tmp:
-            tmp.write(contents)
-    except requests.exceptions.RequestException as err:
-        return {"error": f"Error occurred during file upload: {str(err)}"}
-    try:
-        indexing_stats = ingest_txt(file_path=f"{file.filename}", index_name=f"{token}-{index_name}")
-        os.remove(f"{file.filename}")
-        final_response = JSONResponse(status_code=200, content=f"file name - {file.filename} uploaded successfully with the following stats: {indexing_stats}")
-        return final_response
-    except requests.exceptions.RequestException as err:
-        return JSONResponse(status_code=400, content={f"error: Error occurred during file upload: {str(err)}"})
+    return await _upsert_file(file=file, index_name=index_name, token=token, kind="txt")
 
 
 
@@ -186,21 +191,7 @@ async def upsert_excel(
             detail="Invalid or expired token",
             headers={"WWW-Authenticate": "Bearer"},
         ) 
-    if file.content_type not in ["application/vnd.ms-excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"]:
-        return JSONResponse(status_code=400, content={"error": "Only xls or xlsx files are supported"})
-    try:
-        contents = await file.read()
-        with open(f"{file.filename}","wb") as tmp:
-            tmp.write(contents)
-    except requests.exceptions.RequestException as err:
-        return {"error": f"Error occurred during file upload: {str(err)}"}
-    try:
-        indexing_stats = ingest_excel(file_path=f"{file.filename}", index_name=f"{token}-{index_name}")
-        os.remove(f"{file.filename}") 
-        final_response = JSONResponse(status_code=200, content=f"file name - {file.filename} uploaded successfully with the following stats: {indexing_stats}")
-        return final_response
-    except requests.exceptions.RequestException as err:
-        return JSONResponse(status_code=400, content={f"error: Error occurred during file upload: {str(err)}"})
+    return await _upsert_file(file=file, index_name=index_name, token=token, kind="excel")
 
 
 # Ingest PPT
@@ -216,21 +207,7 @@ async def upsert_ppt(
             detail="Invalid or expired token",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    if file.content_type != "application/vnd.openxmlformats-officedocument.presentationml.presentation":
-        return JSONResponse(status_code=400, content={"error": "Only PPTX file is supported"})
-    try:
-        contents = await file.read()
-        with open(f"{file.filename}","wb") as tmp:
-            tmp.write(contents)
-    except requests.exceptions.RequestException as err:
-        return {"error": f"Error occurred during file upload: {str(err)}"}
-    try:
-        indexing_stats = ingest_ppt(file_path=f"{file.filename}", index_name=f"{token}-{index_name}")
-        os.remove(f"{file.filename}")
-        final_response = JSONResponse(status_code=200, content=f"file name - {file.filename} uploaded successfully with the following stats: {indexing_stats}")
-        return final_response
-    except requests.exceptions.RequestException as err:
-        return JSONResponse(status_code=400, content={f"error: Error occurred during file upload: {str(err)}"})
+    return await _upsert_file(file=file, index_name=index_name, token=token, kind="ppt")
 
 
 # Ingest DOC
@@ -246,24 +223,26 @@ async def upsert_doc(
             detail="Invalid or expired token",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    if file.content_type != "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-        return JSONResponse(status_code=400, content={"error": "Only DOCX file is supported"})
-    try:
-        contents = await file.read()
-        with open(f"{file.filename}","wb") as tmp:
-            tmp.write(contents)
-    except requests.exceptions.RequestException as err:
-        return {"error": f"Error occurred during file upload: {str(err)}"}
-    try:
-        indexing_stats = ingest_doc(file_path=f"{file.filename}", index_name=f"{token}-{index_name}")
-        os.remove(f"{file.filename}")
-        final_response = JSONResponse(status_code=200, content=f"file name - {file.filename} uploaded successfully with the following stats: {indexing_stats}")
-        return final_response
-        
-    except requests.exceptions.RequestException as err:
-        return JSONResponse(status_code=400, content={f"error: Error occurred during file upload: {str(err)}"})
+    return await _upsert_file(file=file, index_name=index_name, token=token, kind="doc")
     
 
+@router.get("/api/v1/ingest_jobs/{job_id}")
+async def get_ingest_job(
+    job_id: str,
+    token: str = Depends(get_bearer_token),
+):
+    if not verify_token(token):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    job = ingest_queue.get(job_id)
+    if job is None or job.tenant != tenant_key(token):
+        return JSONResponse(status_code=404, content={"error": f"Ingestion job {job_id} not found"})
+    return JSONResponse(status_code=200, content=job.to_dict())
+
+
 @router.delete("/api/v1/delete_all_vectors/{index_name}")
 async def delete_vectors(
     index_name: str,
@@ -0,0 +1,315 @@
+"""Background ingestion jobs.
+
+Uploads are saved to disk by the request handler and handed to an
+`IngestJobQueue`, which runs the ingestion pipeline on a bounded pool of
+worker threads and keeps job state in a local SQLite database so clients can
+poll for progress.
+
+Several server processes can share the database. Each queue owns the jobs it
+accepted and refreshes their heartbeat while it runs; a job whose heartbeat is
+older than `INGEST_JOB_STALE_SECONDS` belonged to a process that died, and is
+marked failed by whichever queue notices it first.
+"""
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from dotenv import load_dotenv, find_dotenv
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+load_dotenv(find_dotenv())
+
+INGEST_JOBS_DB_PATH = os.getenv("INGEST_JOBS_DB_PATH", "ingest_jobs.sqlite")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_MAX_PENDING_PER_TENANT = int(os.getenv("INGEST_MAX_PENDING_PER_TENANT", "20"))
+INGEST_HEARTBEAT_SECONDS = float(os.getenv("INGEST_HEARTBEAT_SECONDS", "15"))
+INGEST_JOB_STALE_SECONDS = float(os.getenv("INGEST_JOB_STALE_SECONDS", "120"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when a tenant already has the maximum number of pending jobs."""
+
+
+@dataclass
+class IngestFile:
+    name: str
+    path: str
+    kind: str
+
+
+@dataclass
+class IngestJob:
+    id: str
+    tenant: str
+    index_name: str
+    files: list[IngestFile]
+    state: str = QUEUED
+    progress: dict = field(default_factory=dict)
+    indexing_stats: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    owner: Optional[str] = None
+    heartbeat_at: float = field(default_factory=time.time)
+    # Qdrant collection to ingest into. Only kept in memory: collection names
+    # contain the tenant's token, and only the accepting process runs the job.
+    collection: Optional[str] = field(default=None, repr=False)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "state": self.state,
+            "index_name": self.index_name,
+            "file_names": [file.name for file in self.files],
+            "progress": self.progress,
+            "indexing_stats": self.indexing_stats,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class IngestJobStore:
+    """Persists job state in SQLite. A new connection is used per call, so it is safe across threads."""
+
+    CREATE_TABLES_QUERY = """
+    CREATE TABLE IF NOT EXISTS ingest_jobs (
+        id TEXT PRIMARY KEY,
+        tenant TEXT NOT NULL,
+        index_name TEXT NOT NULL,
+        files TEXT NOT NULL,
+        state TEXT NOT NULL,
+        progress TEXT NOT NULL,
+        indexing_stats TEXT,
+        error TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        owner TEXT,
+        heartbeat_at REAL
+    );
+    """
+
+    # Columns added after the table was first shipped, with their types.
+    ADDED_COLUMNS = {"owner": "TEXT", "heartbeat_at": "REAL"}
+
+    def __init__(self, db_path: str = INGEST_JOBS_DB_PATH):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(self.CREATE_TABLES_QUERY)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(ingest_jobs)")}
+            for column, column_type in self.ADDED_COLUMNS.items():
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE ingest_jobs ADD COLUMN {column} {column_type}")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def create(self, job: IngestJob) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO ingest_jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job.id,
+                    job.tenant,
+                    job.index_name,
+                    json.dumps([vars(file) for file in job.files]),
+                    job.state,
+                    json.dumps(job.progress),
+                    json.dumps(job.indexing_stats) if job.indexing_stats is not None else None,
+                    job.error,
+                    job.created_at,
+                    job.updated_at,
+                    job.owner,
+                    job.heartbeat_at,
+                ),
+            )
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        fields["updated_at"] = time.time()
+        for key in ("progress", "indexing_stats"):
+            if key in fields and fields[key] is not None:
+                fields[key] = json.dumps(fields[key])
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE ingest_jobs SET {assignments} WHERE id = ?",
+                (*fields.values(), job_id),
+            )
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM ingest_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        values = dict(row)
+        values["files"] = [IngestFile(**file) for file in json.loads(values["files"])]
+        values["progress"] = json.loads(values["progress"])
+        if values["indexing_stats"] is not None:
+            values["indexing_stats"] = json.loads(values["indexing_stats"])
+        return IngestJob(**values)
+
+    def heartbeat(self, owner: str) -> None:
+        """Mark the owner's unfinished jobs as still alive."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE ingest_jobs SET heartbeat_at = ? WHERE owner = ? AND state IN (?, ?)",
+                (time.time(), owner, QUEUED, RUNNING),
+            )
+
+    def fail_stale(self, reason: str, stale_after: float = INGEST_JOB_STALE_SECONDS) -> int:
+        """
+        Mark unfinished jobs whose owner stopped sending heartbeats as failed; their uploads are gone.
+
+        Jobs from before heartbeats were recorded have none and count as stale.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE ingest_jobs SET state = ?, error = ?, updated_at = ? "
+                "WHERE state IN (?, ?) AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                (FAILED, reason, now, QUEUED, RUNNING, now - stale_after),
+            )
+        return cur.rowcount
+
+
+class IngestJobQueue:
+    """
+    Runs ingestion jobs on a fixed number of worker threads.
+
+    Pending jobs are kept per tenant and workers take them round-robin across
+    tenants, so one tenant uploading many files cannot starve the others.
+    """
+
+    def __init__(
+        self,
+        store: IngestJobStore,
+        runner: Callable[..., dict],
+        cleanup: Callable[[str], None],
+        workers: int = INGEST_WORKERS,
+        max_pending_per_tenant: int = INGEST_MAX_PENDING_PER_TENANT,
+    ):
+        self.store = store
+        self.runner = runner
+        self.cleanup = cleanup
+        self.workers = workers
+        self.max_pending_per_tenant = max_pending_per_tenant
+        self._pending: OrderedDict[str, deque[IngestJob]] = OrderedDict()
+        self._condition = threading.Condition()
+        self._threads: list[threading.Thread] = []
+        self._stopping = False
+        self._stopped = threading.Event()
+        # Unique per queue, so a restarted process with a reused pid does not adopt old jobs.
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def start(self) -> None:
+        self._stopping = False
+        self._stopped.clear()
+        self.store.fail_stale("Interrupted by a server restart, please upload the file again.")
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"ingest-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name="ingest-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop the workers. Jobs still waiting for one are failed and their uploads removed."""
+        with self._condition:
+            self._stopping = True
+            self._stopped.set()
+            pending = [job for jobs in self._pending.values() for job in jobs]
+            self._pending.clear()
+            self._condition.notify_all()
+        for job in pending:
+            self.store.update(job.id, state=FAILED, error="Interrupted by a server shutdown, please upload the file again.")
+            for file in job.files:
+                self.cleanup(file.path)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _heartbeat(self) -> None:
+        while not self._stopped.wait(INGEST_HEARTBEAT_SECONDS):
+            try:
+                self.store.heartbeat(self.owner)
+                # Also picks up the jobs of a process that died while this one was running.
+                self.store.fail_stale("Interrupted by a server restart, please upload the file again.")
+            except Exception:
+                traceback.print_exc()
+
+    def submit(self, tenant: str, index_name: str, collection: str, files: list[IngestFile]) -> IngestJob:
+        job = IngestJob(
+            id=str(uuid.uuid4()),
+            tenant=tenant,
+            index_name=index_name,
+            files=files,
+            owner=self.owner,
+            collection=collection,
+        )
+        with self._condition:
+            if len(self._pending.get(tenant, ())) >= self.max_pending_per_tenant:
+                raise QueueFullError(
+                    f"Too many pending ingestion jobs (max {self.max_pending_per_tenant})"
+                )
+            self.store.create(job)
+            self._pending.setdefault(tenant, deque()).append(job)
+            self._condition.notify()
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self.store.get(job_id)
+
+    def _next_job(self) -> Optional[IngestJob]:
+        with self._condition:
+            while not self._pending and not self._stopping:
+                self._condition.wait()
+            if self._stopping:
+                return None
+            tenant, pending = self._pending.popitem(last=False)
+            job = pending.popleft()
+            if pending:
+                # Back of the line, behind every other tenant with pending work.
+                self._pending[tenant] = pending
+            return job
+
+    def _work(self) -> None:
+        while (job := self._next_job()) is not None:
+            self._run(job)
+
+    def _run(self, job: IngestJob) -> None:
+        progress: dict = {}
+
+        def on_progress(update: dict) -> None:
+            progress.update(update)
+            self.store.update(job.id, progress=progress)
+
+        self.store.update(job.id, state=RUNNING)
+        try:
+            indexing_stats = self.runner(
+                files=[(file.path, file.kind) for file in job.files],
+                index_name=job.collection,
+                on_progress=on_progress,
+            )
+            self.store.update(job.id, state=SUCCEEDED, indexing_stats=indexing_stats)
+        except Exception as err:
+            traceback.print_exc()
+            self.store.update(job.id, state=FAILED, error=f"Error occurred during ingestion: {str(err)}")
+        finally:
+            for file in job.files:
+                self.cleanup(file.path)
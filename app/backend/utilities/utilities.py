@@ -1,6 +1,14 @@
 from supabase import create_client, Client
+from postgrest.exceptions import APIError
 from dotenv import load_dotenv
 
+from fastapi import HTTPException, UploadFile, status
+
+from typing import Optional
+import shutil
+import tempfile
+import threading
+import time
 import os
 
 load_dotenv()
@@ -10,10 +18,147 @@ SUPABASE_PROJECT_URL = os.getenv("SUPABASE_PROJECT_URL")
 SUPABASE_ANON_PUBLIC_KEY = os.getenv("SUPABASE_ANON_PUBLIC_KEY")
 supabase: Client = create_client(SUPABASE_PROJECT_URL, SUPABASE_ANON_PUBLIC_KEY)
 
+# Uploads are copied to disk in chunks of this size, so memory use does not depend on the file size.
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_SIZE_MB = float(os.getenv("MAX_UPLOAD_SIZE_MB", "100"))
+
+# A revoked business owner keeps working for at most TOKEN_CACHE_TTL_SECONDS
+# unless `invalidate_token` is called for it.
+TOKEN_CACHE_TTL_SECONDS = float(os.getenv("TOKEN_CACHE_TTL_SECONDS", "300"))
+TOKEN_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("TOKEN_CACHE_NEGATIVE_TTL_SECONDS", "30"))
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000"))
+
+# Postgres "invalid_text_representation": the token is not a valid business_owner id.
+_INVALID_ID_SQLSTATE = "22P02"
+
+
+class TokenVerifier:
+    """
+    Checks bearer tokens against the business_owner table.
+
+    Results (valid and invalid) are kept in an in-process TTL cache, and a miss
+    does a point lookup on the id instead of reading the whole table.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        ttl: float = TOKEN_CACHE_TTL_SECONDS,
+        negative_ttl: float = TOKEN_CACHE_NEGATIVE_TTL_SECONDS,
+        max_entries: int = TOKEN_CACHE_MAX_ENTRIES,
+    ):
+        self.client = client
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cache: dict[str, tuple[bool, float]] = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, token: str) -> bool:
+        try:
+            response = (
+                self.client.table("business_owner")
+                .select("id")
+                .eq("id", token)
+                .limit(1)
+                .execute()
+            )
+        except APIError as err:
+            if err.code == _INVALID_ID_SQLSTATE:
+                return False
+            raise
+        return len(response.data) > 0
+
+    def verify(self, token: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(token)
+            if entry is not None and entry[1] > now:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        is_valid = self._lookup(token)
+
+        expires_at = now + (self.ttl if is_valid else self.negative_ttl)
+        with self._lock:
+            if len(self._cache) >= self.max_entries:
+                self._evict_expired(now)
+            if len(self._cache) >= self.max_entries:
+                # Still full: drop the oldest inserted entry.
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[token] = (is_valid, expires_at)
+        return is_valid
+
+    def _evict_expired(self, now: float) -> None:
+        for key in [key for key, (_, expires_at) in self._cache.items() if expires_at <= now]:
+            del self._cache[key]
+
+    def invalidate(self, token: Optional[str] = None) -> None:
+        """Forget a cached token, or every cached token if none is given."""
+        with self._lock:
+            if token is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(token, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._cache),
+            }
+
+
+token_verifier = TokenVerifier(supabase)
+
+
 def verify_token(token: str):
-    response = supabase.table("business_owner").select("id").execute()
-    token_db = response.data
-    token_ids = {token["id"] for token in token_db}
-    if token not in token_ids:
-        return False
-    return True
\ No newline at end of file
+    return token_verifier.verify(token)
+
+
+def invalidate_token(token: Optional[str] = None) -> None:
+    """Call when a business owner is revoked so the token stops working immediately."""
+    token_verifier.invalidate(token)
+
+
+async def save_upload_file(file: UploadFile, max_size_mb: float = MAX_UPLOAD_SIZE_MB) -> str:
+    """
+    Stream an upload into a new private temp directory and return the file path.
+
+    The file keeps its original name (so document sources stay stable), but every
+    upload gets its own directory, so concurrent uploads with the same name never
+    collide. Raises a 413 HTTPException once the upload exceeds `max_size_mb`.
+    The caller owns the directory and must release it with `remove_upload_file`.
+    """
+    max_bytes = int(max_size_mb * 1024 * 1024)
+    too_large = HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File exceeds the maximum upload size of {max_size_mb:g} MB",
+    )
+    if file.size is not None and file.size > max_bytes:
+        raise too_large
+
+    tmp_dir = tempfile.mkdtemp(prefix="rasi-upload-")
+    file_path = os.path.join(tmp_dir, os.path.basename(file.filename or "") or "upload")
+    try:
+        written = 0
+        with open(file_path, "wb") as tmp:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                written += len(chunk)
+                if written > max_bytes:
+                    raise too_large
+                tmp.write(chunk)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return file_path
+
+
+def remove_upload_file(file_path: str) -> None:
+    shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
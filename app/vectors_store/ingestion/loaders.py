@@ -0,0 +1,223 @@
+"""Registry of document loaders, keyed by file kind, content type and extension.
+
+Parsing is CPU-bound pure Python, so `parse_files` runs it on a process pool
+(`PARSE_WORKERS`) instead of the calling thread. PDFs are split into page
+ranges of `PDF_PAGES_PER_TASK` so one large file is spread across workers.
+"""
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+from dotenv import load_dotenv, find_dotenv
+
+from langchain_core.documents import Document
+
+from langchain_community.document_loaders import (
+    Docx2txtLoader,
+    JSONLoader,
+    PyPDFLoader,
+    TextLoader,
+    UnstructuredExcelLoader,
+    UnstructuredPowerPointLoader,
+)
+from langchain_community.document_loaders.csv_loader import CSVLoader
+
+import multiprocessing
+import os
+import threading
+
+load_dotenv(find_dotenv())
+
+# 0 parses in the calling thread, which is what the loaders did before the pool existed.
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "20"))
+
+
+@dataclass(frozen=True)
+class LoaderSpec:
+    kind: str
+    label: str
+    """How the file type is named in error messages, e.g. "Only {label} is supported"."""
+    content_types: tuple[str, ...]
+    extensions: tuple[str, ...]
+    load: Callable[[str], List[Document]]
+
+
+LOADERS: dict[str, LoaderSpec] = {}
+
+
+def register_loader(spec: LoaderSpec) -> LoaderSpec:
+    LOADERS[spec.kind] = spec
+    return spec
+
+
+def get_loader(kind: str) -> LoaderSpec:
+    if kind not in LOADERS:
+        raise ValueError(f"No loader registered for file kind: {kind}")
+    return LOADERS[kind]
+
+
+def find_loader(file_name: str, content_type: Optional[str] = None) -> Optional[LoaderSpec]:
+    """Pick a loader by content type, falling back to the file extension."""
+    for spec in LOADERS.values():
+        if content_type in spec.content_types:
+            return spec
+    extension = os.path.splitext(file_name or "")[1].lower()
+    for spec in LOADERS.values():
+        if extension in spec.extensions:
+            return spec
+    return None
+
+
+def load_documents(file_path: str, kind: str) -> List[Document]:
+    """
+    Load a file with the loader registered for `kind`.
+
+    The file name is used as the document source. Uploads are stored in a
+    per-request temp directory, so the full path changes on every upload; the
+    record manager keys documents on `source`, and a stable value is what lets
+    a re-upload replace the previous version of the file.
+    """
+    docs = get_loader(kind).load(file_path)
+    source = os.path.basename(file_path)
+    for doc in docs:
+        doc.metadata["source"] = source
+    return docs
+
+
+# Worker functions. Results cross the process boundary as plain
+# (page_content, metadata) tuples, which pickle much faster than Documents.
+ParsedPage = Tuple[str, dict]
+
+
+def _parse_file(file_path: str, kind: str) -> List[ParsedPage]:
+    return [(doc.page_content, doc.metadata) for doc in load_documents(file_path, kind)]
+
+
+def _parse_pdf_pages(file_path: str, start: int, stop: int) -> List[ParsedPage]:
+    """Same output as PyPDFLoader, for pages [start, stop) only."""
+    import pypdf
+
+    source = os.path.basename(file_path)
+    reader = pypdf.PdfReader(file_path)
+    return [
+        (reader.pages[page].extract_text(), {"source": source, "page": page})
+        for page in range(start, min(stop, len(reader.pages)))
+    ]
+
+
+def _pdf_page_count(file_path: str) -> int:
+    import pypdf
+
+    return len(pypdf.PdfReader(file_path).pages)
+
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_parse_pool_lock = threading.Lock()
+
+
+def get_parse_pool() -> Optional[ProcessPoolExecutor]:
+    global _parse_pool
+    if PARSE_WORKERS <= 0:
+        return None
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # spawn, not fork: ingestion runs on threads of a process that also runs the event loop.
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _parse_pool
+
+
+def shutdown_parse_pool() -> None:
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=False, cancel_futures=True)
+            _parse_pool = None
+
+
+def parse_files(files: List[Tuple[str, str]]) -> List[Document]:
+    """
+    Parse (file_path, kind) pairs on the process pool and return their Documents in input order.
+
+    Falls back to `load_documents` in the calling thread when `PARSE_WORKERS` is 0.
+    """
+    pool = get_parse_pool()
+    if pool is None:
+        docs = []
+        for file_path, kind in files:
+            docs.extend(load_documents(file_path, kind))
+        return docs
+
+    futures: List[Future] = []
+    for file_path, kind in files:
+        if kind == "pdf":
+            page_count = _pdf_page_count(file_path)
+            for start in range(0, page_count, PDF_PAGES_PER_TASK):
+                futures.append(pool.submit(_parse_pdf_pages, file_path, start, start + PDF_PAGES_PER_TASK))
+        else:
+            futures.append(pool.submit(_parse_file, file_path, kind))
+
+    docs = []
+    for future in futures:
+        docs.extend(
+            Document(page_content=page_content, metadata=metadata)
+            for page_content, metadata in future.result()
+        )
+    return docs
+
+
+register_loader(LoaderSpec(
+    kind="csv",
+    label="CSV file",
+    content_types=("text/csv",),
+    extensions=(".csv",),
+    load=lambda file_path: CSVLoader(file_path=file_path).load(),
+))
+register_loader(LoaderSpec(
+    kind="json",
+    label="JSON file",
+    content_types=("application/json",),
+    extensions=(".json",),
+    load=lambda file_path: JSONLoader(file_path=file_path, jq_schema=".", text_content=False).load(),
+))
+register_loader(LoaderSpec(
+    kind="pdf",
+    label="PDF file",
+    content_types=("application/pdf",),
+    extensions=(".pdf",),
+    load=lambda file_path: PyPDFLoader(file_path=file_path).load(),
+))
+register_loader(LoaderSpec(
+    kind="txt",
+    label="TXT file",
+    content_types=("text/plain",),
+    extensions=(".txt",),
+    load=lambda file_path: TextLoader(file_path=file_path).load(),
+))
+register_loader(LoaderSpec(
+    kind="excel",
+    label="xls or xlsx files",
+    content_types=(
+        "application/vnd.ms-excel",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ),
+    extensions=(".xls", ".xlsx"),
+    load=lambda file_path: UnstructuredExcelLoader(file_path=file_path).load(),
+))
+register_loader(LoaderSpec(
+    kind="ppt",
+    label="PPTX file",
+    content_types=("application/vnd.openxmlformats-officedocument.presentationml.presentation",),
+    extensions=(".pptx",),
+    load=lambda file_path: UnstructuredPowerPointLoader(file_path=file_path).load(),
+))
+register_loader(LoaderSpec(
+    kind="doc",
+    label="DOCX file",
+    content_types=("application/vnd.openxmlformats-officedocument.wordprocessingml.document",),
+    extensions=(".docx",),
+    load=lambda file_path: Docx2txtLoader(file_path=file_path).load(),
+))
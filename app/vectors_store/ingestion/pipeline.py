@@ -0,0 +1,127 @@
+from dotenv import load_dotenv, find_dotenv
+
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
+
+import logging
+import os
+
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from langchain.indexes import index
+
+from app.LLM.utilities.context_packing import count_tokens
+from app.vectors_store.ingestion.loaders import parse_files
+from app.vectors_store.utilities.index_versions import index_versions
+from app.vectors_store.utilities.utilities import create_collection_if_missing, get_embedding, get_qdrant_langchain_client, get_record_manager_client
+
+load_dotenv(find_dotenv())
+
+logger = logging.getLogger(__name__)
+
+# Chunks handed to the vector store per add_texts call. Large enough that the
+# batch embedder can pack them into several concurrent requests.
+INGEST_INDEX_BATCH_SIZE = int(os.getenv("INGEST_INDEX_BATCH_SIZE", "512"))
+
+
+@lru_cache(maxsize=None)
+def get_text_splitter() -> RecursiveCharacterTextSplitter:
+    # Shared by every ingestion: loading the tiktoken encoder is not free and the splitter holds no per-file state.
+    # start_index lets lookup_info cut the overlap between neighbouring chunks.
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        model_name="gpt-4o", chunk_size=4000, chunk_overlap=200, add_start_index=True
+    )
+
+
+class _ProgressEmbeddings(Embeddings):
+    """Passes embedding calls through and reports every batch the vector store embeds."""
+
+    def __init__(self, embeddings: Embeddings, on_batch: Callable[[int], None]):
+        self.embeddings = embeddings
+        self.on_batch = on_batch
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.embeddings.embed_documents(texts)
+        self.on_batch(len(texts))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+
+def ingest_files(
+    files: List[Tuple[str, str]],
+    index_name: str = "random_index_name",
+    on_progress: Optional[Callable[[dict], None]] = None,
+) -> dict:
+    """
+    Load, split and index a batch of files into the Qdrant collection `index_name`.
+
+    Args:
+        files (List[Tuple[str, str]]): (file_path, kind) pairs, where kind is a key of
+            `app.vectors_store.ingestion.loaders.LOADERS` ("pdf", "csv", ...).
+        index_name (str, optional): The name of the Qdrant collection. Defaults to "random_index_name".
+        on_progress (Callable, optional): Called with partial progress updates
+            (pages loaded, chunks produced, chunks embedded).
+
+    Returns:
+        dict: The indexing statistics returned by `langchain.indexes.index`.
+    """
+    docs = parse_files(files)
+    if on_progress:
+        on_progress({"pages": len(docs)})
+
+    text_splitter = get_text_splitter()
+    chunks = text_splitter.split_documents(docs)
+    for chunk in chunks:
+        chunk.metadata["token_count"] = count_tokens(chunk.page_content)
+    if on_progress:
+        on_progress({"chunks": len(chunks)})
+
+    create_collection_if_missing(index_name)
+
+    embedding = get_embedding()
+    if on_progress:
+        embedded = 0
+
+        def on_batch(count: int) -> None:
+            nonlocal embedded
+            embedded += count
+            on_progress({"chunks_embedded": embedded})
+
+        embedding = _ProgressEmbeddings(embedding, on_batch)
+
+    vectorstore = get_qdrant_langchain_client(index_name=index_name, embedding=embedding, vector_name=index_name)
+
+    record_manager = get_record_manager_client(index_name=index_name)
+
+    # One index() call for the whole batch: incremental cleanup still works per source file.
+    try:
+        indexing_stats = index(
+            chunks,
+            record_manager,
+            vectorstore,
+            batch_size=INGEST_INDEX_BATCH_SIZE,
+            cleanup="incremental",
+            source_id_key="source",
+            )
+    finally:
+        # Also on failure: index() writes batch by batch, so earlier batches may be in.
+        index_versions.bump(index_name)
+    if on_progress:
+        # Unchanged chunks are skipped without embedding; the final count comes from the index stats.
+        on_progress({"chunks_embedded": indexing_stats["num_added"] + indexing_stats["num_updated"]})
+
+    print(f"----- {len(files)} FILE(S) INGESTED -----")
+    logger.info("Embedding cache: %s", get_embedding().stats())
+    return indexing_stats
+
+
+def ingest_file(
+    file_path: str,
+    kind: str,
+    index_name: str = "random_index_name",
+    on_progress: Optional[Callable[[dict], None]] = None,
+) -> dict:
+    return ingest_files([(file_path, kind)], index_name=index_name, on_progress=on_progress)
@@ -0,0 +1,192 @@
+"""Token-packed, concurrent OpenAI embedding with adaptive rate-limit backoff.
+
+`BatchEmbeddings` packs texts into requests of at most `EMBED_BATCH_MAX_TOKENS`
+tokens and sends several requests at once. The number of requests in flight
+starts at `EMBED_CONCURRENCY`, grows by one after a full round of successes and
+halves on every 429, waiting out the Retry-After the API asks for. Connection
+errors, timeouts and 5xx responses are retried with exponential backoff, as
+the SDK would. Vectors are always returned in input order.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from typing import List, Optional
+
+from dotenv import load_dotenv, find_dotenv
+
+from langchain_core.embeddings import Embeddings
+
+import asyncio
+import os
+import threading
+import time
+
+import openai
+import tiktoken
+
+load_dotenv(find_dotenv())
+
+EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", "100000"))
+# The embeddings endpoint accepts at most 2048 inputs per request.
+EMBED_BATCH_MAX_TEXTS = int(os.getenv("EMBED_BATCH_MAX_TEXTS", "2048"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "16"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "8"))
+
+# Failures worth retrying besides 429s. APITimeoutError is an APIConnectionError.
+_TRANSIENT_ERRORS = (openai.APIConnectionError, openai.InternalServerError)
+
+
+class AdaptiveConcurrency:
+    """
+    Additive-increase / multiplicative-decrease limit on requests in flight.
+
+    `acquire` blocks while the limit is reached, or while a Retry-After pause set
+    by `rate_limited` is still running.
+    """
+
+    def __init__(self, initial: int = EMBED_CONCURRENCY, maximum: int = EMBED_MAX_CONCURRENCY):
+        self.maximum = maximum
+        self.limit = max(1, min(initial, maximum))
+        self._in_flight = 0
+        self._successes = 0
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    self._condition.wait(pause)
+                elif self._in_flight >= self.limit:
+                    self._condition.wait()
+                else:
+                    self._in_flight += 1
+                    return
+
+    def release(self) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def succeeded(self) -> None:
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self._successes = 0
+                self._condition.notify_all()
+
+    def rate_limited(self, retry_after: float) -> None:
+        with self._condition:
+            self.limit = max(1, self.limit // 2)
+            self._successes = 0
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+
+def _backoff(attempt: int) -> float:
+    return min(2 ** attempt, 60)
+
+
+def _retry_after(err: openai.RateLimitError, attempt: int) -> float:
+    headers = err.response.headers if err.response is not None else {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return float(headers[header]) * scale
+        except (KeyError, TypeError, ValueError):
+            pass
+    return _backoff(attempt)
+
+
+class BatchEmbeddings(Embeddings):
+    """OpenAI embeddings sent as concurrent, token-packed batches. See the module docstring."""
+
+    def __init__(self, model: str, concurrency: Optional[AdaptiveConcurrency] = None):
+        self.model = model
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        # Retries are handled here, so the client must surface every failure.
+        self.client = openai.OpenAI(max_retries=0)
+        self.async_client = openai.AsyncOpenAI(max_retries=0)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency.maximum, thread_name_prefix="embed")
+
+    @cached_property
+    def encoding(self) -> tiktoken.Encoding:
+        return tiktoken.encoding_for_model(self.model)
+
+    def pack(self, texts: List[str]) -> List[List[int]]:
+        """Group text indexes into batches that stay under the token and input limits."""
+        batches: List[List[int]] = []
+        batch: List[int] = []
+        batch_tokens = 0
+        for i, text in enumerate(texts):
+            tokens = len(self.encoding.encode(text, disallowed_special=()))
+            if batch and (batch_tokens + tokens > EMBED_BATCH_MAX_TOKENS or len(batch) >= EMBED_BATCH_MAX_TEXTS):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        for attempt in range(EMBED_MAX_RETRIES + 1):
+            self.concurrency.acquire()
+            try:
+                response = self.client.embeddings.create(input=texts, model=self.model)
+            except openai.RateLimitError as err:
+                if attempt == EMBED_MAX_RETRIES:
+                    raise
+                self.concurrency.rate_limited(_retry_after(err, attempt))
+                continue
+            except _TRANSIENT_ERRORS:
+                if attempt == EMBED_MAX_RETRIES:
+                    raise
+                response = None
+            finally:
+                self.concurrency.release()
+            if response is None:
+                # Not the API pushing back, so the other requests keep going.
+                time.sleep(_backoff(attempt))
+                continue
+            self.concurrency.succeeded()
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        batches = self.pack(texts)
+        futures = [self._executor.submit(self._embed_batch, [texts[i] for i in batch]) for batch in batches]
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        for batch, future in zip(batches, futures):
+            for i, vector in zip(batch, future.result()):
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_batch([text])[0]
+
+    async def _aembed_batch(self, texts: List[str]) -> List[List[float]]:
+        for attempt in range(EMBED_MAX_RETRIES + 1):
+            try:
+                response = await self.async_client.embeddings.create(input=texts, model=self.model)
+            except openai.RateLimitError as err:
+                if attempt == EMBED_MAX_RETRIES:
+                    raise
+                retry_after = _retry_after(err, attempt)
+                self.concurrency.rate_limited(retry_after)
+                await asyncio.sleep(retry_after)
+                continue
+            except _TRANSIENT_ERRORS:
+                if attempt == EMBED_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(_backoff(attempt))
+                continue
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if len(texts) == 1:
+            # Query embeddings: one short request, no need to leave the event loop.
+            return await self._aembed_batch(texts)
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self._aembed_batch([text]))[0]
@@ -0,0 +1,242 @@
+"""Persistent, content-addressed embedding cache.
+
+`CachedEmbeddings` wraps any LangChain `Embeddings` and stores every vector in
+a local SQLite database keyed by (model, sha256(text)), so the same text is
+only ever sent to OpenAI once per model, whichever tenant, index or query it
+comes from. Entries are evicted least-recently-used once the cache holds more
+than `EMBEDDING_CACHE_MAX_ENTRIES` vectors.
+
+Recency is tracked coarsely: hits are remembered in memory and their
+`last_used` is written at most every `EMBEDDING_CACHE_TOUCH_INTERVAL_SECONDS`.
+The entry count is counted once and then kept up to date from this process's
+inserts; it is only recounted when it says the cache is over the limit.
+"""
+from typing import List, Optional
+
+from dotenv import load_dotenv, find_dotenv
+
+from langchain_core.embeddings import Embeddings
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+load_dotenv(find_dotenv())
+
+EMBEDDING_CACHE_DB_PATH = os.getenv("EMBEDDING_CACHE_DB_PATH", "embedding_cache.sqlite")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "1000000"))
+EMBEDDING_CACHE_TOUCH_INTERVAL_SECONDS = float(os.getenv("EMBEDDING_CACHE_TOUCH_INTERVAL_SECONDS", "60"))
+# USD per million input tokens, used to estimate what the hits saved. text-embedding-3-small list price.
+EMBEDDING_PRICE_PER_MILLION_TOKENS = float(os.getenv("EMBEDDING_PRICE_PER_MILLION_TOKENS", "0.02"))
+
+# Rough token estimate for the savings report; not used for anything that must be exact.
+_CHARS_PER_TOKEN = 4
+# SQLite's default limit on host parameters per statement is 999 on older builds.
+_LOOKUP_BATCH_SIZE = 500
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCacheStore:
+    """Stores float32 vectors in SQLite. A new connection is used per call, so it is safe across threads."""
+
+    CREATE_TABLES_QUERY = """
+    CREATE TABLE IF NOT EXISTS embeddings (
+        model TEXT NOT NULL,
+        text_hash TEXT NOT NULL,
+        vector BLOB NOT NULL,
+        last_used REAL NOT NULL,
+        PRIMARY KEY (model, text_hash)
+    );
+    CREATE INDEX IF NOT EXISTS embeddings_last_used_idx ON embeddings (last_used);
+    """
+
+    def __init__(
+        self,
+        db_path: str = EMBEDDING_CACHE_DB_PATH,
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+        touch_interval: float = EMBEDDING_CACHE_TOUCH_INTERVAL_SECONDS,
+    ):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        # Hits whose last_used is not written yet, and when they were last written.
+        self._touched: dict[tuple[str, str], float] = {}
+        self._touched_at = time.monotonic()
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.CREATE_TABLES_QUERY)
+            (self._count,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def get_many(self, model: str, hashes: List[str]) -> dict[str, List[float]]:
+        found: dict[str, List[float]] = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._connect() as conn:
+            for i in range(0, len(unique), _LOOKUP_BATCH_SIZE):
+                batch = unique[i:i + _LOOKUP_BATCH_SIZE]
+                placeholders = ", ".join("?" for _ in batch)
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    (model, *batch),
+                ).fetchall()
+                for hash_, vector in rows:
+                    found[hash_] = np.frombuffer(vector, dtype=np.float32).tolist()
+        if found:
+            now = time.time()
+            with self._lock:
+                for hash_ in found:
+                    self._touched[(model, hash_)] = now
+                due = time.monotonic() - self._touched_at >= self.touch_interval
+            if due:
+                self.flush_touched()
+        return found
+
+    def flush_touched(self) -> None:
+        """Write the last_used of the hits recorded since the last flush."""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            self._touched_at = time.monotonic()
+        if touched:
+            with self._connect() as conn:
+                self._write_touched(conn, touched)
+
+    def _write_touched(self, conn: sqlite3.Connection, touched: dict[tuple[str, str], float]) -> None:
+        conn.executemany(
+            "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+            [(last_used, model, hash_) for (model, hash_), last_used in touched.items()],
+        )
+
+    def put_many(self, model: str, vectors: dict[str, List[float]]) -> None:
+        if not vectors:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+                [
+                    (model, hash_, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                    for hash_, vector in vectors.items()
+                ],
+            )
+            with self._lock:
+                # An upper bound: a text embedded concurrently elsewhere replaces a row instead.
+                self._count += len(vectors)
+                over_limit = self._count > self.max_entries
+            if over_limit:
+                self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        # Recent hits must not be evicted for want of a flushed last_used.
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            self._touched_at = time.monotonic()
+        self._write_touched(conn, touched)
+        (count,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count > self.max_entries:
+            # Trim to 90% so eviction does not run on every insert once the cache is full.
+            excess = count - int(self.max_entries * 0.9)
+            conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            count -= excess
+        with self._lock:
+            self._count = count
+
+    def size(self) -> int:
+        """Number of cached vectors, as last counted plus this process's inserts since."""
+        with self._lock:
+            return self._count
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings that look every text up in an `EmbeddingCacheStore` first and only
+    send the misses to the wrapped `embeddings`.
+
+    Query and document embeddings share the cache: OpenAI embeds both the same way.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, store: Optional[EmbeddingCacheStore] = None):
+        self.embeddings = embeddings
+        self.model = model
+        self.store = store or EmbeddingCacheStore()
+        self.hits = 0
+        self.misses = 0
+        self.hit_chars = 0
+        self.miss_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _split(self, texts: List[str]) -> tuple[List[str], dict[str, List[float]], List[tuple[str, str]]]:
+        hashes = [text_hash(text) for text in texts]
+        cached = self.store.get_many(self.model, hashes)
+        missing: dict[str, str] = {}
+        for hash_, text in zip(hashes, texts):
+            if hash_ not in cached:
+                missing.setdefault(hash_, text)
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+            self.hit_chars += sum(len(text) for hash_, text in zip(hashes, texts) if hash_ in cached)
+        return hashes, cached, list(missing.items())
+
+    def _record(self, cached: dict, missing: list, vectors: List[List[float]], seconds: float) -> None:
+        # Rounded to float32 like the stored copy, so a text embeds identically on a hit and a miss.
+        new = {
+            hash_: np.asarray(vector, dtype=np.float32).tolist()
+            for (hash_, _), vector in zip(missing, vectors)
+        }
+        self.store.put_many(self.model, new)
+        cached.update(new)
+        with self._lock:
+            self.miss_seconds += seconds
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes, cached, missing = self._split(texts)
+        if missing:
+            started = time.perf_counter()
+            vectors = self.embeddings.embed_documents([text for _, text in missing])
+            self._record(cached, missing, vectors, time.perf_counter() - started)
+        return [cached[hash_] for hash_ in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes, cached, missing = await asyncio.to_thread(self._split, texts)
+        if missing:
+            started = time.perf_counter()
+            vectors = await self.embeddings.aembed_documents([text for _, text in missing])
+            await asyncio.to_thread(self._record, cached, missing, vectors, time.perf_counter() - started)
+        return [cached[hash_] for hash_ in hashes]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            # Each hit is assumed to have cost what an average miss cost.
+            seconds_per_text = self.miss_seconds / self.misses if self.misses else 0.0
+            tokens_saved = self.hit_chars // _CHARS_PER_TOKEN
+            return {
+                "model": self.model,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "estimated_tokens_saved": tokens_saved,
+                "estimated_usd_saved": tokens_saved * EMBEDDING_PRICE_PER_MILLION_TOKENS / 1_000_000,
+                "estimated_seconds_saved": self.hits * seconds_per_text,
+                "size": self.store.size(),
+            }
@@ -0,0 +1,403 @@
+"""Hybrid dense + sparse (BM25) retrieval on Qdrant.
+
+Dense embeddings miss exact tokens such as product codes, SKUs and prices, so
+collections also carry a sparse vector named `SPARSE_VECTOR_NAME`, computed
+locally:
+
+- documents store the BM25 term-frequency part of each term's weight
+  (saturated by `BM25_K1`, length-normalised by `BM25_B` against the
+  collection's average document length when they are written);
+- queries carry each term's IDF, computed from a per-collection table of
+  document frequencies and total length kept next to the record manager tables
+  (`RECORD_MANAGER_DB_URL`). `HybridQdrant` updates it from the terms of each
+  batch it upserts or deletes, and readers reload it every
+  `SPARSE_IDF_CACHE_TTL_SECONDS`.
+
+The dot product of the two is the BM25 score. `HybridRetriever` runs the dense
+and the sparse search in one `search_batch` call and fuses them with
+reciprocal rank fusion. Collections created before sparse vectors existed
+keep working with dense-only retrieval.
+"""
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Iterable, List, Optional, Sequence
+
+from dotenv import load_dotenv, find_dotenv
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from langchain_qdrant import Qdrant
+
+from qdrant_client import QdrantClient
+from qdrant_client.http import models as rest
+
+from sqlalchemy import BigInteger, Column, Integer, MetaData, String, Table, Text, create_engine, inspect, insert, select, text, update
+from sqlalchemy.engine import Engine
+
+import asyncio
+import json
+import math
+import os
+import re
+import threading
+import time
+
+import mmh3
+
+load_dotenv(find_dotenv())
+
+SPARSE_VECTOR_NAME = "bm25"
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# Candidates fetched from each of the dense and sparse searches before fusion.
+HYBRID_PREFETCH_LIMIT = int(os.getenv("HYBRID_PREFETCH_LIMIT", "20"))
+# Reciprocal rank fusion constant, 60 in the original paper.
+RRF_K = int(os.getenv("RRF_K", "60"))
+# How long a process serves a collection's IDF table before reading it again.
+SPARSE_IDF_CACHE_TTL_SECONDS = float(os.getenv("SPARSE_IDF_CACHE_TTL_SECONDS", "60"))
+_SCROLL_BATCH_SIZE = 1000
+
+# Words, numbers and codes such as "AB-1234", "v2.1" or "19.99" are kept whole.
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms; a compound code also yields its parts, so "AB-1234" matches "1234"."""
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = re.split(r"[-_./]", token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+def term_id(term: str) -> int:
+    return mmh3.hash(term, signed=False)
+
+
+def _doc_term_counts(text: str) -> Counter:
+    return Counter(term_id(term) for term in tokenize(text))
+
+
+def _encode_counts(counts: List[Counter], avg_length: Optional[float] = None) -> List[rest.SparseVector]:
+    lengths = [sum(count.values()) for count in counts]
+    if not avg_length:
+        # First documents of a collection: nothing to compare with but each other.
+        avg_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+    vectors = []
+    for count, length in zip(counts, lengths):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length) if avg_length else BM25_K1
+        indices = list(count)
+        vectors.append(rest.SparseVector(
+            indices=indices,
+            values=[count[i] * (BM25_K1 + 1) / (count[i] + norm) for i in indices],
+        ))
+    return vectors
+
+
+def encode_documents(texts: List[str], avg_length: Optional[float] = None) -> List[rest.SparseVector]:
+    """Sparse vectors of documents, normalised against `avg_length` (the collection's), or the texts' own average."""
+    return _encode_counts([_doc_term_counts(text) for text in texts], avg_length)
+
+
+class SparseIDF:
+    """Document frequencies of one collection, turned into BM25 IDF weights for queries."""
+
+    def __init__(self, doc_count: int, df: dict[int, int], total_length: int = 0):
+        self.doc_count = doc_count
+        self.df = df
+        self.total_length = total_length
+
+    @property
+    def avg_length(self) -> float:
+        return self.total_length / self.doc_count if self.doc_count else 0.0
+
+    def idf(self, index: int) -> float:
+        df = self.df.get(index, 0)
+        return math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+
+    def encode_query(self, query: str) -> rest.SparseVector:
+        # Terms missing from the table are kept at the highest weight: they may be
+        # in documents written since it was loaded (a new SKU), and cost nothing otherwise.
+        indices = sorted({term_id(term) for term in tokenize(query)})
+        return rest.SparseVector(indices=indices, values=[self.idf(i) for i in indices])
+
+
+_metadata = MetaData()
+sparse_idf_table = Table(
+    "sparse_idf",
+    _metadata,
+    Column("collection", String, primary_key=True),
+    Column("doc_count", Integer, nullable=False),
+    # JSON object of term id -> document frequency.
+    Column("df", Text, nullable=False),
+    # Sum of the documents' lengths in terms; NULL in rows written before it was tracked.
+    Column("total_length", BigInteger),
+)
+
+
+@lru_cache(maxsize=None)
+def _get_engine(db_url: str) -> Engine:
+    engine = create_engine(db_url)
+    _metadata.create_all(engine)
+    if "total_length" not in {column["name"] for column in inspect(engine).get_columns("sparse_idf")}:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE sparse_idf ADD COLUMN total_length BIGINT"))
+    return engine
+
+
+def has_sparse_vectors(params: Optional[rest.CollectionParams]) -> bool:
+    return params is not None and SPARSE_VECTOR_NAME in (params.sparse_vectors or {})
+
+
+def sparse_vectors_config() -> dict[str, rest.SparseVectorParams]:
+    return {SPARSE_VECTOR_NAME: rest.SparseVectorParams()}
+
+
+_idf_cache: dict[tuple[str, str], tuple[SparseIDF, float]] = {}
+_idf_cache_lock = threading.Lock()
+
+
+def _remember_idf(collection_name: str, db_url: str, idf: SparseIDF) -> SparseIDF:
+    with _idf_cache_lock:
+        _idf_cache[(db_url, collection_name)] = (idf, time.monotonic() + SPARSE_IDF_CACHE_TTL_SECONDS)
+    return idf
+
+
+def _cached_idf(collection_name: str, db_url: str) -> Optional[SparseIDF]:
+    with _idf_cache_lock:
+        entry = _idf_cache.get((db_url, collection_name))
+    if entry is None or entry[1] <= time.monotonic():
+        return None
+    return entry[0]
+
+
+def _save_idf(conn, collection_name: str, idf: SparseIDF, exists: bool) -> None:
+    values = dict(doc_count=idf.doc_count, df=json.dumps(idf.df), total_length=idf.total_length)
+    if exists:
+        conn.execute(update(sparse_idf_table).where(sparse_idf_table.c.collection == collection_name).values(**values))
+    else:
+        conn.execute(insert(sparse_idf_table).values(collection=collection_name, **values))
+
+
+def init_sparse_idf(collection_name: str, db_url: str) -> None:
+    """Create the empty IDF row of a new collection."""
+    with _get_engine(db_url).begin() as conn:
+        exists = conn.execute(
+            select(sparse_idf_table.c.collection).where(sparse_idf_table.c.collection == collection_name)
+        ).first()
+        if exists is None:
+            _save_idf(conn, collection_name, SparseIDF(0, {}), exists=False)
+
+
+def rebuild_sparse_idf(
+    client: QdrantClient, collection_name: str, db_url: str, content_payload_key: str = "page_content"
+) -> SparseIDF:
+    """Recount document frequencies and lengths from the texts stored in the collection. A full scan: repair only."""
+    df: Counter = Counter()
+    doc_count = 0
+    total_length = 0
+    offset = None
+    while True:
+        records, offset = client.scroll(
+            collection_name=collection_name,
+            limit=_SCROLL_BATCH_SIZE,
+            offset=offset,
+            with_payload=[content_payload_key],
+            with_vectors=False,
+        )
+        for record in records:
+            counts = _doc_term_counts((record.payload or {}).get(content_payload_key) or "")
+            df.update(counts.keys())
+            total_length += sum(counts.values())
+            doc_count += 1
+        if offset is None:
+            break
+
+    idf = SparseIDF(doc_count, dict(df), total_length)
+    with _get_engine(db_url).begin() as conn:
+        exists = conn.execute(
+            select(sparse_idf_table.c.collection)
+            .where(sparse_idf_table.c.collection == collection_name)
+            .with_for_update()
+        ).first()
+        _save_idf(conn, collection_name, idf, exists=exists is not None)
+    return _remember_idf(collection_name, db_url, idf)
+
+
+def update_sparse_idf(
+    collection_name: str, db_url: str, added: List[Counter], removed: List[Counter]
+) -> Optional[SparseIDF]:
+    """
+    Apply the term counts of documents written to and removed from the collection.
+
+    Returns None if the collection has no complete row yet (created before
+    lengths were tracked); `rebuild_sparse_idf` has to count it once.
+    """
+    with _get_engine(db_url).begin() as conn:
+        # The row lock serialises concurrent writers to the same collection.
+        row = conn.execute(
+            select(sparse_idf_table.c.doc_count, sparse_idf_table.c.df, sparse_idf_table.c.total_length)
+            .where(sparse_idf_table.c.collection == collection_name)
+            .with_for_update()
+        ).first()
+        if row is None or row.total_length is None:
+            return None
+        df = Counter({int(index): count for index, count in json.loads(row.df).items()})
+        total_length = row.total_length
+        for counts in added:
+            df.update(counts.keys())
+            total_length += sum(counts.values())
+        for counts in removed:
+            df.subtract(counts.keys())
+            total_length -= sum(counts.values())
+        # Unary plus drops the terms no document contains any more.
+        idf = SparseIDF(max(0, row.doc_count + len(added) - len(removed)), dict(+df), max(0, total_length))
+        _save_idf(conn, collection_name, idf, exists=True)
+    return _remember_idf(collection_name, db_url, idf)
+
+
+def load_sparse_idf(collection_name: str, db_url: str) -> SparseIDF:
+    with _get_engine(db_url).connect() as conn:
+        row = conn.execute(
+            select(sparse_idf_table.c.doc_count, sparse_idf_table.c.df, sparse_idf_table.c.total_length)
+            .where(sparse_idf_table.c.collection == collection_name)
+        ).first()
+    if row is None:
+        return SparseIDF(0, {})
+    return SparseIDF(
+        row.doc_count,
+        {int(index): df for index, df in json.loads(row.df).items()},
+        row.total_length or 0,
+    )
+
+
+def get_sparse_idf(collection_name: str, db_url: str) -> SparseIDF:
+    """The collection's IDF table, read again once it is `SPARSE_IDF_CACHE_TTL_SECONDS` old."""
+    idf = _cached_idf(collection_name, db_url)
+    if idf is None:
+        idf = _remember_idf(collection_name, db_url, load_sparse_idf(collection_name, db_url))
+    return idf
+
+
+class HybridQdrant(Qdrant):
+    """`Qdrant` vector store that also writes a BM25 sparse vector with every point and keeps the IDF table current."""
+
+    def __init__(self, *args: Any, idf_db_url: str, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.idf_db_url = idf_db_url
+
+    def _stored_term_counts(self, ids: Sequence[Any]) -> List[Counter]:
+        """Term counts of the points with these ids that are in the collection."""
+        counts = []
+        for i in range(0, len(ids), _SCROLL_BATCH_SIZE):
+            records = self.client.retrieve(
+                collection_name=self.collection_name,
+                ids=list(ids[i:i + _SCROLL_BATCH_SIZE]),
+                with_payload=[self.content_payload_key],
+                with_vectors=False,
+            )
+            counts.extend(
+                _doc_term_counts((record.payload or {}).get(self.content_payload_key) or "") for record in records
+            )
+        return counts
+
+    def _update_idf(self, added: List[Counter], removed: List[Counter]) -> SparseIDF:
+        idf = update_sparse_idf(self.collection_name, self.idf_db_url, added, removed)
+        if idf is None:
+            idf = rebuild_sparse_idf(self.client, self.collection_name, self.idf_db_url, self.content_payload_key)
+        return idf
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[Sequence[str]] = None,
+        batch_size: int = 64,
+        **kwargs: Any,
+    ) -> List[str]:
+        idf = get_sparse_idf(self.collection_name, self.idf_db_url)
+        added_ids = []
+        for batch_ids, points in self._generate_rest_batches(texts, metadatas, ids, batch_size):
+            counts = [_doc_term_counts(point.payload[self.content_payload_key]) for point in points]
+            for point, sparse_vector in zip(points, _encode_counts(counts, idf.avg_length)):
+                point.vector[SPARSE_VECTOR_NAME] = sparse_vector
+            # Points upserted again replace their old terms.
+            replaced = self._stored_term_counts(batch_ids)
+            self.client.upsert(collection_name=self.collection_name, points=points, **kwargs)
+            idf = self._update_idf(counts, replaced)
+            added_ids.extend(batch_ids)
+        return added_ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        removed = self._stored_term_counts(ids or [])
+        result = super().delete(ids, **kwargs)
+        if removed:
+            self._update_idf([], removed)
+        return result
+
+
+def reciprocal_rank_fusion(result_lists: List[List[rest.ScoredPoint]], k: int = RRF_K) -> List[rest.ScoredPoint]:
+    scores: dict[Any, float] = {}
+    points: dict[Any, rest.ScoredPoint] = {}
+    for results in result_lists:
+        for rank, point in enumerate(results):
+            scores[point.id] = scores.get(point.id, 0.0) + 1.0 / (k + rank + 1)
+            points.setdefault(point.id, point)
+    return [points[point_id] for point_id in sorted(scores, key=scores.get, reverse=True)]
+
+
+class HybridRetriever(BaseRetriever):
+    """Fused dense + BM25 search over one collection. See the module docstring."""
+
+    client: Any
+    async_client: Any
+    collection_name: str
+    dense_vector_name: str
+    embeddings: Embeddings
+    idf_db_url: str
+    k: int = 4
+    content_payload_key: str = "page_content"
+    metadata_payload_key: str = "metadata"
+
+    def _requests(self, query: str, dense_vector: List[float], idf: SparseIDF) -> List[rest.SearchRequest]:
+        requests = [rest.SearchRequest(
+            vector=rest.NamedVector(name=self.dense_vector_name, vector=dense_vector),
+            limit=HYBRID_PREFETCH_LIMIT,
+            with_payload=True,
+        )]
+        sparse_vector = idf.encode_query(query)
+        if sparse_vector.indices:
+            requests.append(rest.SearchRequest(
+                vector=rest.NamedSparseVector(name=SPARSE_VECTOR_NAME, vector=sparse_vector),
+                limit=HYBRID_PREFETCH_LIMIT,
+                with_payload=True,
+            ))
+        return requests
+
+    def _documents(self, result_lists: List[List[rest.ScoredPoint]]) -> List[Document]:
+        return [
+            Qdrant._document_from_scored_point(
+                point, self.collection_name, self.content_payload_key, self.metadata_payload_key
+            )
+            for point in reciprocal_rank_fusion(result_lists)[:self.k]
+        ]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        idf = get_sparse_idf(self.collection_name, self.idf_db_url)
+        requests = self._requests(query, self.embeddings.embed_query(query), idf)
+        return self._documents(self.client.search_batch(collection_name=self.collection_name, requests=requests))
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        idf = _cached_idf(self.collection_name, self.idf_db_url)
+        if idf is None:
+            idf = await asyncio.to_thread(get_sparse_idf, self.collection_name, self.idf_db_url)
+        requests = self._requests(query, await self.embeddings.aembed_query(query), idf)
+        return self._documents(
+            await self.async_client.search_batch(collection_name=self.collection_name, requests=requests)
+        )
@@ -0,0 +1,27 @@
+"""Per-index version counters used to invalidate caches of retrieval results.
+
+Every write to an index (ingestion or deletion) bumps its version, and caches
+include the version in their keys, so entries from before the write are never
+served again. The counters live in process memory: with several server
+processes, the caches' TTLs bound how long another process can serve results
+from before a write.
+"""
+import threading
+
+
+class IndexVersions:
+    def __init__(self):
+        self._versions: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, index_name: str) -> int:
+        with self._lock:
+            return self._versions.get(index_name, 0)
+
+    def bump(self, index_name: str) -> int:
+        with self._lock:
+            self._versions[index_name] = self._versions.get(index_name, 0) + 1
+            return self._versions[index_name]
+
+
+index_versions = IndexVersions()
@@ -1,38 +1,136 @@
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, AsyncQdrantClient
 from langchain_qdrant import Qdrant
 
 from langchain.indexes import SQLRecordManager
 
-from langchain_openai import OpenAIEmbeddings
-
 from langchain_core.retrievers import BaseRetriever
 
+from app.vectors_store.utilities.batch_embedder import BatchEmbeddings
+from app.vectors_store.utilities.embedding_cache import CachedEmbeddings
+from app.vectors_store.utilities.hybrid import (
+    HybridQdrant,
+    HybridRetriever,
+    has_sparse_vectors,
+    init_sparse_idf,
+    sparse_vectors_config,
+)
+
+from qdrant_client.http import models as rest
+
 from dotenv import load_dotenv, find_dotenv
 
+from functools import lru_cache
+from typing import Optional
+
 import os
+import threading
+import time
 
 load_dotenv(find_dotenv())
 
 QDRANT_URL = os.environ["QDRANT_URL"]
 QDRANT_API_KEY = os.environ["QDRANT_API_KEY"]
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "false").lower() == "true"
+# Chunks fetched per lookup_info call; the tool packs them into its token budget.
+RETRIEVER_K = int(os.getenv("RETRIEVER_K", "4"))
+QDRANT_COLLECTION_CACHE_TTL_SECONDS = float(os.getenv("QDRANT_COLLECTION_CACHE_TTL_SECONDS", "300"))
 
 RECORD_MANAGER_DB_URL = os.environ["RECORD_MANAGER_DB_URL"]
 
+@lru_cache(maxsize=None)
+def get_embedding(model: str = "text-embedding-3-small") -> CachedEmbeddings:
+    """One cached embeddings client per model, shared by ingestion, deletion and retrieval."""
+    return CachedEmbeddings(BatchEmbeddings(model=model), model=model)
+
+
+# The clients are shared by the whole process so their keep-alive connection
+# pools are reused; building one per call paid connection setup every time.
+@lru_cache(maxsize=None)
 def get_qdrant_vectorstore_client() -> QdrantClient:
     return QdrantClient(
         url=QDRANT_URL, 
         api_key=QDRANT_API_KEY,
+        prefer_grpc=QDRANT_PREFER_GRPC,
     )
-    
-    
-def get_qdrant_langchain_client(index_name: str, embedding, vector_name: str) -> Qdrant:
-    return Qdrant(
+
+
+@lru_cache(maxsize=None)
+def get_qdrant_async_client() -> AsyncQdrantClient:
+    return AsyncQdrantClient(
+        url=QDRANT_URL,
+        api_key=QDRANT_API_KEY,
+        prefer_grpc=QDRANT_PREFER_GRPC,
+    )
+
+
+class CollectionCache:
+    """
+    TTL cache of the Qdrant collections known to exist, with their vector params.
+
+    Only existing collections are cached: a missing one is looked up again on the
+    next call, so a collection created by another process is picked up at once.
+    """
+
+    def __init__(self, ttl: float = QDRANT_COLLECTION_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self._entries: dict[str, tuple[rest.CollectionParams, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, index_name: str) -> Optional[rest.CollectionParams]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(index_name)
+            if entry is not None and entry[1] > now:
+                return entry[0]
+
+        client = get_qdrant_vectorstore_client()
+        if not client.collection_exists(collection_name=index_name):
+            self.forget(index_name)
+            return None
+        params = client.get_collection(collection_name=index_name).config.params
+        self.set(index_name, params)
+        return params
+
+    def set(self, index_name: str, params: rest.CollectionParams) -> None:
+        with self._lock:
+            self._entries[index_name] = (params, time.monotonic() + self.ttl)
+
+    def forget(self, index_name: str) -> None:
+        with self._lock:
+            self._entries.pop(index_name, None)
+
+
+collection_cache = CollectionCache()
+
+
+def get_qdrant_langchain_client(index_name: str, embedding, vector_name: str, async_client: AsyncQdrantClient = None) -> Qdrant:
+    kwargs = dict(
         client=get_qdrant_vectorstore_client(),
         collection_name=index_name,
         embeddings=embedding,
         vector_name=index_name,
+        async_client=async_client or get_qdrant_async_client(),
     )
+    # Collections created before hybrid retrieval have no sparse vector to write to.
+    if has_sparse_vectors(collection_cache.get(index_name)):
+        return HybridQdrant(idf_db_url=RECORD_MANAGER_DB_URL, **kwargs)
+    return Qdrant(**kwargs)
     
+def create_collection_if_missing(index_name: str) -> None:
+    if collection_cache.get(index_name) is None:
+        get_qdrant_vectorstore_client().create_collection(
+            collection_name=index_name,
+            vectors_config= {
+                index_name: rest.VectorParams(
+                    distance=rest.Distance.COSINE,
+                    size=1536,
+                ),
+            },
+            sparse_vectors_config=sparse_vectors_config(),
+        )
+        init_sparse_idf(index_name, RECORD_MANAGER_DB_URL)
+
+
 def get_record_manager_client(index_name: str) -> SQLRecordManager:
     record_manager =  SQLRecordManager(
         f"weaviate/{index_name}", db_url=RECORD_MANAGER_DB_URL
@@ -43,12 +141,25 @@ def get_record_manager_client(index_name: str) -> SQLRecordManager:
     
     
 def get_qdrant_retriever(index_name: str) -> BaseRetriever:
+    if has_sparse_vectors(collection_cache.get(index_name)):
+        return HybridRetriever(
+            client=get_qdrant_vectorstore_client(),
+            async_client=get_qdrant_async_client(),
+            collection_name=index_name,
+            dense_vector_name=index_name,
+            embeddings=get_embedding(),
+            idf_db_url=RECORD_MANAGER_DB_URL,
+            k=RETRIEVER_K,
+        )
     
-    embedding = OpenAIEmbeddings(model="text-embedding-3-small")
-        
-    vectorstore = get_qdrant_langchain_client(index_name=index_name, embedding=embedding, vector_name=index_name)
+    vectorstore = get_qdrant_langchain_client(
+        index_name=index_name,
+        embedding=get_embedding(),
+        vector_name=index_name,
+        async_client=get_qdrant_async_client(),
+    )
     
-    vectorstore_retriever = vectorstore.as_retriever()
+    vectorstore_retriever = vectorstore.as_retriever(search_kwargs={"k": RETRIEVER_K})
     
     return vectorstore_retriever
         
\ No newline at end of file